@@ -0,0 +1,73 @@
+import os, sys, json, time
+import fehwiki_parse, fehwiki_lxml
+
+# compares the BeautifulSoup and lxml page parsers on saved parse API responses
+# usage: python bench_parsers.py [directory, defaults to the fixtures kept in the repo] [rounds]
+# the response cache (http_cache) makes a larger set once the bot or full_update has filled it
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixtures(directory):
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as fixture:
+            contents = fixture.read()
+        # response cache files start with a line of validators, .json files are plain responses
+        if not name.endswith('.json'):
+            contents = contents.split(b'\n', 1)[-1]
+        try:
+            info = json.loads(contents.decode('utf-8'))
+        except ValueError:
+            continue
+        if isinstance(info, dict) and 'parse' in info and 'text' in info['parse']:
+            fixtures.append((info['parse']['title'], info))
+    return fixtures
+
+
+def run(parser, fixtures):
+    results = []
+    for title, info in fixtures:
+        try:
+            results.append(parser(title, info))
+        except Exception as ex:
+            results.append(repr(ex))
+    return results
+
+
+def bench(parser, fixtures, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        run(parser, fixtures)
+    elapsed = time.perf_counter() - start
+    return len(fixtures) * rounds / elapsed
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else fixtures_dir
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    fixtures = load_fixtures(directory)
+    if not fixtures:
+        print("No parse responses in %s." % directory)
+        sys.exit(1)
+    print("%d pages from %s" % (len(fixtures), directory))
+
+    mismatches = [title for (title, info), expected, actual in
+                  zip(fixtures, run(fehwiki_parse.parse_data, fixtures), run(fehwiki_lxml.parse_data, fixtures))
+                  if expected != actual]
+    for title in mismatches:
+        print("Different data for " + title)
+    handled = 0
+    for title, info in fixtures:
+        if any(' '.join(k['*'].split('_')) in fehwiki_lxml.extracted_categories for k in info['parse']['categories']):
+            try:
+                fehwiki_lxml.extract_data(title, info)
+                handled += 1
+            except Exception:
+                pass
+    print("%d/%d pages identical, %d parsed by lxml itself" % (len(fixtures) - len(mismatches), len(fixtures), handled))
+
+    bs4_rate = bench(fehwiki_parse.parse_data, fixtures, rounds)
+    lxml_rate = bench(fehwiki_lxml.parse_data, fixtures, rounds)
+    print("bs4:  %.1f pages/sec" % bs4_rate)
+    print("lxml: %.1f pages/sec (%.1fx)" % (lxml_rate, lxml_rate / bs4_rate))
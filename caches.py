@@ -0,0 +1,101 @@
+import time, asyncio, functools
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """Bounded mapping whose entries expire ttl seconds after being stored.
+    The least recently used entry is dropped once maxsize is reached."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return default
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class LRUCache(object):
+    """Bounded mapping that drops the least recently used entry once maxsize is reached."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SingleFlight(object):
+    """Registry of calls in progress, concurrent callers asking for the same key await the one call."""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, function, *args, **kwargs):
+        call = self.calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(function(*args, **kwargs))
+            self.calls[key] = call
+            call.add_done_callback(lambda done: self.calls.pop(key) if self.calls.get(key) is done else None)
+        # shielded so one caller giving up doesn't cancel the call for everyone else
+        return await asyncio.shield(call)
+
+
+def single_flight(function=None, key=None):
+    # concurrent calls of function with the same arguments share one call
+    # key gives what identifies a call from its arguments, for functions with arguments that don't change the result
+    if function is None:
+        return functools.partial(single_flight, key=key)
+    flights = SingleFlight()
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        flight = key(*args, **kwargs) if key is not None else (args, tuple(sorted(kwargs.items())))
+        return await flights.do(flight, function, *args, **kwargs)
+    wrapper.flights = flights
+    return wrapper
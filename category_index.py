@@ -0,0 +1,45 @@
+from collections import defaultdict
+
+
+class CategoryIndex(object):
+    """Inverted index from wiki categories to the cached titles in them, kept next to FehCache.categories.
+    Categories are also found by their lower case name."""
+
+    def __init__(self, categories=None):
+        self.members = defaultdict(set)
+        self.title_categories = {}
+        self.names = {}
+        if categories is not None:
+            for title, title_categories in categories.items():
+                self.add(title, title_categories)
+
+    def add(self, title, categories):
+        self.discard(title)
+        self.title_categories[title] = set(categories)
+        for category in self.title_categories[title]:
+            self.members[category].add(title)
+            self.names[category.lower()] = category
+
+    def discard(self, title):
+        for category in self.title_categories.pop(title, ()):
+            self.members[category].discard(title)
+            if not self.members[category]:
+                del self.members[category]
+                # another category differing only in case may have taken the lower case name since
+                if self.names.get(category.lower()) == category:
+                    del self.names[category.lower()]
+
+    def find(self, name):
+        # the category as the wiki writes it, None if no cached title is in it
+        if name in self.members:
+            return name
+        return self.names.get(name.lower())
+
+    def titles(self, category):
+        return self.members.get(category, set())
+
+    def __contains__(self, category):
+        return category in self.members
+
+    def __len__(self):
+        return len(self.members)
@@ -18,13 +18,13 @@ class DragaliaLost:
             return
 
         # resolve name
-        arg = dlwiki_parse.resolve_name(arg)
+        arg = await dlwiki_parse.resolve_name(arg)
         print(arg)
         # identify category
-        category = dlwiki_parse.get_category(arg)
+        category = await dlwiki_parse.get_category(arg)
         print(category)
         # use the right query
-        data = dlwiki_parse.search(category, arg)
+        data = await dlwiki_parse.search(category, arg)
         print(data)
         # display that shit
 
@@ -66,12 +66,12 @@ class DragaliaLost:
             return
 
         # resolve name
-        arg = dlwiki_parse.resolve_name(arg)
+        arg = await dlwiki_parse.resolve_name(arg)
         # identify category
-        category = dlwiki_parse.get_category(arg)
+        category = await dlwiki_parse.get_category(arg)
         print(category)
         # use the right query
-        data = dlwiki_parse.search(category, arg, quick=True)
+        data = await dlwiki_parse.search(category, arg, quick=True)
         print(data)
         # display that shit
 
@@ -3,6 +3,7 @@ import itertools
 import re
 from bs4 import BeautifulSoup as BSoup
 from fehwiki_parse import get_page
+from caches import single_flight
 from collections import OrderedDict
 from difflib import SequenceMatcher
 
@@ -438,18 +439,18 @@ weapon_query_table = {
 }
 
 
-def resolve_name(arg):
+async def resolve_name(arg):
     search = dl_api_base + "?action=query&list=search&srsearch={}&redirects=resolve".format(urllib.parse.quote(arg))
-    results = get_page(search)['query']
+    results = (await get_page(search))['query']
     if results['searchinfo']['totalhits'] == 0:
-        return resolve_name(results['searchinfo']['suggestion']) if 'suggestion' in results['searchinfo'] else None
+        return (await resolve_name(results['searchinfo']['suggestion'])) if 'suggestion' in results['searchinfo'] else None
     # sort search results and get the one closest to search term
     return sorted([r['title'] for r in results['search']],
                   key=lambda x:SequenceMatcher(None, arg, x).ratio(), reverse=True)[0]
 
-def get_category(arg):
+async def get_category(arg):
     url = dl_api_base + "?action=parse&page={}".format(urllib.parse.quote(arg))
-    info = get_page(url, 'categories')
+    info = await get_page(url, 'categories')
     if info:
         categories = [' '.join(k['*'].split('_')) for k in info['parse']['categories']]
         return valid_categories[[v in categories for v in valid_categories].index(True)]
@@ -457,8 +458,8 @@ def get_category(arg):
         return None
 
 
-def get_query_results(url):
-    results = get_page(url)['cargoquery'][0]['title']
+async def get_query_results(url):
+    results = (await get_page(url))['cargoquery'][0]['title']
     return {k: re.sub('\n+', '\n', BSoup(re.sub('<br[^>]*>', '\n', BSoup(results[k], 'lxml').text), 'lxml').text)
             for k in results}
 
@@ -514,19 +515,20 @@ def get_ability_strings(data, num_abilities, max_upgrades, simple=False, last_on
                     for i in range(1, num_abilities + 1) if data[f'ab{i}{j}Name']])).replace("'''", '')
               for j in range(1, max_upgrades + 1)])
 
-def search(category, arg, quick=False):
+@single_flight
+async def search(category, arg, quick=False):
     data = OrderedDict()
     data['Embed Info'] = {'Title': arg}
 
-    def adventurer():
+    async def adventurer():
         query = build_query_string('a', adventurer_query_table) + \
                 "&where={}".format(urllib.parse.quote("a.FullName='{}'".format(arg.replace("'", "''"))))
-        raw = get_query_results(query)
+        raw = await get_query_results(query)
 
         data['Embed Info']['URL'] = dl_base + urllib.parse.quote(raw['Page'])
         data['Embed Info']['Colour'] = element_embed_colour[raw['ElementalTypeId']]
         data['Embed Info']['Description'] = raw['Description']
-        icon = get_icon(category, '{}_0{}_r0{}'.format(raw['Id'], raw['VariationId'], raw['Rarity']))
+        icon = await get_icon(category, '{}_0{}_r0{}'.format(raw['Id'], raw['VariationId'], raw['Rarity']))
         if icon:
             print(icon)
             data['Embed Info']['Icon'] = icon
@@ -559,15 +561,15 @@ def search(category, arg, quick=False):
 
         return data
 
-    def dragon():
+    async def dragon():
         query = build_query_string('d', dragon_query_table) + \
                 "&where={}".format(urllib.parse.quote("d.FullName='{}'".format(arg.replace("'", "''"))))
-        raw = get_query_results(query)
+        raw = await get_query_results(query)
 
         data['Embed Info']['URL'] = dl_base + urllib.parse.quote(raw['Page'])
         data['Embed Info']['Colour'] = element_embed_colour[raw['ElementalTypeId']]
         data['Embed Info']['Description'] = raw['ProfileText']
-        icon = get_icon(category, '{}_01'.format(raw['BaseId']))
+        icon = await get_icon(category, '{}_01'.format(raw['BaseId']))
         if icon:
             print(icon)
             data['Embed Info']['Icon'] = icon
@@ -592,14 +594,14 @@ def search(category, arg, quick=False):
         data['Abilities (at 4 unbinds)'] = abilities[1], False
         return data
 
-    def wyrmprint():
+    async def wyrmprint():
         query = build_query_string('w', wyrmprint_query_table) + \
                 "&where={}".format(urllib.parse.quote("w.Name='{}'".format(arg.replace("'", "''"))))
-        raw = get_query_results(query)
+        raw = await get_query_results(query)
         data['Embed Info']['URL'] = dl_base + urllib.parse.quote(raw['Page'])
         data['Embed Info']['Colour'] = rarity_embed_colour[raw['Rarity']]
         data['Embed Info']['Description'] = raw['FlavorText1']
-        icon = get_icon(category, '{}_02'.format(raw['BaseId']))
+        icon = await get_icon(category, '{}_02'.format(raw['BaseId']))
         if icon:
             print(icon)
             data['Embed Info']['Icon'] = icon
@@ -624,14 +626,14 @@ def search(category, arg, quick=False):
             data['Abilities (at 4 unbinds)'] = abilities[2], False
         return data
 
-    def weapon():
+    async def weapon():
         query = build_query_string('w', weapon_query_table) + \
                 "&where={}".format(urllib.parse.quote("w.WeaponName='{}'".format(arg.replace("'", "''"))))
-        raw = get_query_results(query)
+        raw = await get_query_results(query)
         data['Embed Info']['URL'] = dl_base + urllib.parse.quote(raw['Page'])
         data['Embed Info']['Colour'] = element_embed_colour[raw['ElementalTypeId']]
         data['Embed Info']['Description'] = raw['FlavorText']
-        icon = get_icon(category, '{}_01_{}'.format(raw['BaseId'], raw['FormId']))
+        icon = await get_icon(category, '{}_01_{}'.format(raw['BaseId'], raw['FormId']))
         if icon:
             print(icon)
             data['Embed Info']['Icon'] = icon
@@ -663,10 +665,10 @@ def search(category, arg, quick=False):
             data['Abilities'] = abilities[0], False
         return data
 
-    def skill():
+    async def skill():
         pass
 
-    def ability():
+    async def ability():
         pass
 
     switch = {
@@ -678,13 +680,14 @@ def search(category, arg, quick=False):
         'Weapons': weapon
     }
 
-    return switch[category]() if category in switch else None
+    return (await switch[category]()) if category in switch else None
 
 
-def get_icon(category, arg):
+@single_flight
+async def get_icon(category, arg):
     """Get the image url for the icon."""
     url = dl_api_base + '?action=query&titles=File:{}.png'.format(arg)
-    info = get_page(url, 'imageinfo&iiprop=url')
+    info = await get_page(url, 'imageinfo&iiprop=url')
     if '-1' in info['query']['pages']:
         return None
     else:
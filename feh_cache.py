@@ -1,17 +1,31 @@
-import os, jsonpickle, json, numpy, cloudinary, cloudinary.uploader, cloudinary.api, urllib.request, urllib3, unidecode
-import jsonpickle.ext.numpy as jsonpickle_numpy
-jsonpickle_numpy.register_handlers()
+import os, atexit, cloudinary, urllib.parse, urllib3, unidecode
 from feh_alias import *
 from feh_personal import *
-from fehwiki_parse import get_page, shorten_hero_name, feh_source, weapon_colours, valid_categories
+from feh_storage import apply_record, storage_backends, SaveScheduler
+from ngram_index import NgramIndex
+from category_index import CategoryIndex
+from text_index import TextIndex
+from skill_index import SkillIndex
+from caches import TTLCache
+from feh_stats import StatEngine
+from hero_table import HeroTable
+from fehwiki_parse import get_page, forget_page, shorten_hero_name, feh_source, weapon_colours, valid_categories, \
+    hero_stat_arrays
 from collections import deque
 
 cache_log = deque([], 500)
 
-filename = './data_cache.json'
+# 'journal' keeps everything in memory, 'sqlite' keeps pages, aliases and categories on disk
+storage_backend = os.environ.get('FEH_STORAGE', 'journal')
+# names the wiki didn't know are remembered for this long, along with the suggestions given for them
+miss_cache_size = int(os.environ.get('FEH_MISS_CACHE_SIZE', 1000))
+miss_cache_ttl = int(os.environ.get('FEH_MISS_CACHE_TTL', 3600))
 
 class FehCache(object):
-    def __init__(self):
+    def __init__(self, storage=None):
+        self.storage = storage if storage is not None else storage_backends[storage_backend]()
+        self.scheduler = SaveScheduler(lambda: self.storage.save(self))
+        atexit.register(self.flush)
         if not self.load():
             "Starting new cache..."
             self.aliases = aliases
@@ -24,8 +38,14 @@ class FehCache(object):
             self.categories = {}
             self.list = []
             self.last_update = '2017-11-27T00:00:00Z'
-        aliases.update(self.aliases)
-        self.aliases.update(aliases)
+            self.icons = {}
+            self.stat_arrays = {}
+        # add the built in aliases the cache doesn't have yet, cached ones win
+        missing = {alias: title for alias, title in aliases.items() if alias not in self.aliases}
+        if missing:
+            self.aliases.update(missing)
+            self.save()
+        self.build_indexes()
 
     def copy(self, other):
         self.aliases = aliases if 'aliases' not in dir(other) else other.aliases
@@ -36,85 +56,185 @@ class FehCache(object):
         self.replacement_list = set() if 'replacement_list' not in dir(other) else set(other.replacement_list)
         self.data = {} if 'data' not in dir(other) else other.data
         self.categories = {} if 'categories' not in dir(other) else other.categories
-        self.list = [] if 'data' not in dir(other) else other.list
+        self.list = [] if 'list' not in dir(other) else other.list
         self.last_update = '2017-11-27T00:00:00Z' if 'last_update' not in dir(other) else other.last_update
+        self.icons = {} if 'icons' not in dir(other) else other.icons
+        self.stat_arrays = {} if 'stat_arrays' not in dir(other) else other.stat_arrays
 
     def load(self):
         urllib3.disable_warnings()
         cloudinary.config()
-        try:
-            #assert(False) # force local load
-            web_copy = cloudinary.api.resource(filename[2:], resource_type='raw')['url']
-            response = urllib.request.urlopen(web_copy)
-            print("Loaded from the internet.")
-            loaded = jsonpickle.decode(json.load(response))
-            self.copy(loaded)
-            return True
-        except Exception as ex:
-            print(ex)
-            if os.path.exists(filename):
-                print("Loaded from local.")
-                with open(filename, 'r') as to_load:
-                    loaded = jsonpickle.decode(json.load(to_load))
-                    self.copy(loaded)
-                    return True
-            else:
-                return False
+        return self.storage.load(self)
 
+    def reload(self):
+        loaded = self.load()
+        self.build_indexes()
+        return loaded
 
-    def update(self):
+    def build_indexes(self):
+        # lookup structures derived from the cached data, kept current by update_indexes
+        self.alias_index = NgramIndex(self.aliases)
+        self.category_index = CategoryIndex(self.categories)
+        self.text_index = TextIndex(self.data)
+        self.skill_index = SkillIndex()
+        for title in self.categories:
+            self.index_skills(title)
+        self.misses = TTLCache(miss_cache_size, miss_cache_ttl)
+        self.stat_engine = StatEngine(self.stat_arrays)
+        self.hero_table = None
+
+    def update_indexes(self, op, field, key):
+        # a new alias or page can turn a miss into a hit and changes the suggestions
+        if field in ['aliases', 'data']:
+            self.misses.clear()
+        if field == 'stat_arrays':
+            self.stat_engine.discard(key)
+        if field == 'list':
+            self.hero_table = None
+        if field == 'categories':
+            if op == 'set':
+                self.category_index.add(key, self.categories[key])
+            elif op == 'del':
+                self.category_index.discard(key)
+        if field == 'data':
+            if op == 'set':
+                self.text_index.add(key, self.data[key])
+            elif op == 'del':
+                self.text_index.discard(key)
+        if field in ['data', 'categories']:
+            self.index_skills(key)
+        if field == 'aliases':
+            if op == 'set':
+                self.alias_index.add(key)
+            elif op == 'del':
+                self.alias_index.discard(key)
+
+    def index_skills(self, title):
+        # only hero pages, enemy units aren't in the wiki's learner tables
+        if title in self.data and title in self.categories and 'Heroes' in self.categories[title]:
+            self.skill_index.add(title, self.data[title])
+        else:
+            self.skill_index.discard(title)
+
+    def record(self, op, field, key=None, value=None):
+        # apply a mutation and hand it to the storage backend, save() makes it durable
+        with self.storage.lock:
+            apply_record(self, op, field, key, value)
+            self.storage.record(self, op, field, key, value)
+            self.update_indexes(op, field, key)
+
+    async def update(self):
+        # poll recentchanges since last_update and mark changed pages for replacement
         try:
             old_replacement_list = self.replacement_list.copy()
-            changes = get_page('https://feheroes.gamepedia.com/api.php?action=query&list=recentchanges&rcprop=title|timestamp&rclimit=500&rcend=%s&rcnamespace=0|6' % self.last_update)['query']['recentchanges'][:-1]
+            url = 'https://feheroes.gamepedia.com/api.php?action=query&list=recentchanges&rcprop=title|timestamp&rclimit=500&rcend=%s&rcnamespace=0|6' % self.last_update
+            page = await get_page(url)
+            changes = page['query']['recentchanges']
+            while 'continue' in page:
+                page = await get_page(url + ''.join('&%s=%s' % (k, urllib.parse.quote(v)) for k, v in page['continue'].items()))
+                changes.extend(page['query']['recentchanges'])
+            # rcend is inclusive so anything at last_update has already been seen
+            changes = [change for change in changes if change['timestamp'] > self.last_update]
             if changes:
-                deleted = False
-                self.last_update = changes[0]['timestamp']
+                self.record('assign', 'last_update', value=max(change['timestamp'] for change in changes))
+                icons_changed = False
                 for change in changes:
                     title = change['title']
+                    forget_page(title)
+                    if title in self.icons:
+                        # the file was uploaded or replaced, ask the wiki for it again
+                        self.record('del', 'icons', title)
+                        icons_changed = True
                     if title.startswith('File:'):
                         title = (' '.join(title.lstrip('File:').lstrip('Icon_Portrait_').lstrip('Weapon_').split('_'))).rstrip('.png').rstrip('.bmp').rstrip('.jpg').rstrip('.jpeg')
                     if title in self.data and title not in self.replacement_list:
-                        self.replacement_list.add(title)
+                        self.record('add', 'replacement_list', title)
                         cache_log.appendleft('Set %s up for replacement.' % title)
-                if old_replacement_list != self.replacement_list:
+                if old_replacement_list != self.replacement_list or icons_changed:
                     self.save()
+            return changes
         except Exception as ex:
             print(ex)
+            return []
 
     def save(self):
-        print("Saving cache and uploading to cloud...")
-        with open(filename, 'w+') as save_to:
-            json.dump(jsonpickle.encode(self), save_to)
-            save_to.close()
-            result = cloudinary.uploader.upload(filename, resource_type='raw', public_id=filename[2:], invalidate=True)
-        print("Save complete!")
+        # only marks the cache dirty, the write happens later off the event loop
+        self.scheduler.request()
+
+    def flush(self):
+        # write everything out now, used on shutdown
+        self.scheduler.cancel()
+        self.storage.flush(self)
 
     def set_fam(self, type, user, title):
         if type == 'son':
             if title is None and user in self.sons:
-                del self.sons[user]
+                self.record('del', 'sons', user)
             else:
-                self.sons[user] = title
+                self.record('set', 'sons', user, title)
         if type == 'waifu':
             if title is None and user in self.waifus:
-                del self.waifus[user]
+                self.record('del', 'waifus', user)
             else:
-                self.waifus[user] = title
+                self.record('set', 'waifus', user, title)
         self.save()
 
     def set_flaunt(self, user, url):
-        self.flaunts[user] = url
+        self.record('set', 'flaunts', user, url)
         self.save()
 
+    def delete_flaunt(self, user):
+        if user in self.flaunts:
+            self.record('del', 'flaunts', user)
+            self.save()
+
     def set_list(self, list):
-        old_list = self.list
+        # the heroes whose rows changed are merged in and recorded as one assign, a refresh is a single write
         if isinstance(self.list, dict):
-            self.list.update(list)
-        else:
-            self.list = list
-        if self.list != old_list:
+            changed = {name: list[name] for name in list if name not in self.list or self.list[name] != list[name]}
+            if changed:
+                merged = dict(self.list)
+                merged.update(changed)
+                self.record('assign', 'list', value=merged)
+                self.save()
+        elif self.list != list:
+            self.record('assign', 'list', value=list)
             self.save()
 
+    def set_icons(self, icons):
+        # file title to url, '' for files the wiki doesn't have
+        changed = False
+        for file, url in icons.items():
+            if self.icons.get(file) != url:
+                self.record('set', 'icons', file, url)
+                changed = True
+        if changed:
+            self.save()
+
+    def get_hero_table(self):
+        # built again the first time it's needed after the list changes
+        if self.hero_table is None:
+            self.hero_table = HeroTable(self.list)
+        return self.hero_table
+
+    def clear_list(self):
+        self.record('assign', 'list', value=[])
+        self.save()
+
+    def add_replacements(self, titles):
+        for title in titles:
+            if title not in self.replacement_list:
+                self.record('add', 'replacement_list', title)
+
+    def discard_replacement(self, title):
+        if title in self.replacement_list:
+            self.record('discard', 'replacement_list', title)
+
+    def clear_replacements(self):
+        for title in list(self.replacement_list):
+            self.record('discard', 'replacement_list', title)
+        self.save()
+
     def add_alias(self, alias, name, save=True, resolve_conflicts=True):
         alias = alias.lower().replace(' ', '')
         if alias[-1] in ['1','2','3','4']:
@@ -122,7 +242,7 @@ class FehCache(object):
         if alias not in ['son', 'my son', 'waifu', 'my waifu'] and '/' not in alias\
             and (alias not in self.aliases or
                     (alias in self.aliases and name != self.aliases[alias] and not resolve_conflicts)):
-                self.aliases[alias] = name
+                self.record('set', 'aliases', alias, name)
                 cache_log.appendleft('Added alias: %s -> %s' % (alias, name))
                 if save:
                     self.save()
@@ -135,11 +255,13 @@ class FehCache(object):
                 # already an internal disambiguation page
                 if name not in self.data[alias]['1Could refer to:'][0].split('\n'):
                     # add to the internal disambiguation page listings if not already in there
-                    self.data[alias]['1Could refer to:'] = self.data[alias]['1Could refer to:'][0] + '\n' + name, False
+                    new_data = dict(self.data[alias])
+                    new_data['1Could refer to:'] = self.data[alias]['1Could refer to:'][0] + '\n' + name, False
+                    self.record('set', 'data', alias, new_data)
                     cache_log.appendleft('Found alias conflict!\nAdded alias `%s`to disambiguation.' % alias)
                     should_save = True
                 if self.aliases[alias] != alias:
-                    self.aliases[alias] = alias
+                    self.record('set', 'aliases', alias, alias)
                     cache_log.appendleft('Linking alias `%s` to its disambiguation page.' % alias)
                     should_save = True
                 if should_save:
@@ -152,9 +274,9 @@ class FehCache(object):
                 new_data = {'Embed Info': {'Colour':weapon_colours['Null'], 'Icon':None, 'Title':alias,
                                            'URL': feh_source % self.aliases[alias].split(':')[0]},
                             '1Could refer to:': (self.aliases[alias] + '\n' + name, False)}
-                self.data[alias] = new_data
-                self.categories[alias] = ['Disambiguation pages']
-                self.aliases[alias] = alias
+                self.record('set', 'data', alias, new_data)
+                self.record('set', 'categories', alias, ['Disambiguation pages'])
+                self.record('set', 'aliases', alias, alias)
                 cache_log.appendleft(
                     'Found alias conflict!\nCreated disambiguation page for `%s` and linked alias to page.' % alias)
                 if save:
@@ -166,7 +288,7 @@ class FehCache(object):
     def delete_alias(self, alias, save=True):
         if alias in self.aliases:
             cache_log.appendleft('Deleted alias: %s -> %s' % (alias, self.aliases[alias]))
-            del self.aliases[alias]
+            self.record('del', 'aliases', alias)
             if save:
                 self.save()
 
@@ -185,12 +307,8 @@ class FehCache(object):
         return None
 
     def clear_category(self, category):
-        to_delete = []
-        for title in self.categories.keys():
-            if category in self.categories[title]:
-                to_delete.append(title)
-        for title in to_delete:
-            self.delete_data(title)
+        for title in list(self.category_index.titles(category)):
+            self.delete_data(title, save=False)
         self.save()
 
     def add_data(self, alias, data, categories, save=True, force_save=False):
@@ -222,13 +340,23 @@ class FehCache(object):
             else:
                 break
 
-        if name not in self.data or self.data[name] != data:
+        data_changed = name not in self.data or self.data[name] != data
+        if data_changed:
             will_save = True
-            self.data[name] = data
+            self.record('set', 'data', name, data)
             cache_log.appendleft('Added data for: %s' % data['Embed Info']['Title'])
         if name not in self.categories or self.categories[name] != categories:
             will_save = True
-            self.categories[name] = categories
+            self.record('set', 'categories', name, categories)
+        # stats parsed once here so stat queries don't have to read the tables again
+        if any([c in categories for c in ['Heroes', 'Enemy units']]) and (data_changed or name not in self.stat_arrays):
+            arrays = hero_stat_arrays(data)
+            if arrays is not None and self.stat_arrays.get(name) != arrays:
+                will_save = True
+                self.record('set', 'stat_arrays', name, arrays)
+            elif arrays is None and name in self.stat_arrays:
+                will_save = True
+                self.record('del', 'stat_arrays', name)
         if force_save:
             self.save()
         else:
@@ -239,17 +367,19 @@ class FehCache(object):
 
     def delete_data(self, title, save=True):
         if title in self.data:
-            del self.data[title]
-            del self.categories[title]
+            self.record('del', 'data', title)
+            self.record('del', 'categories', title)
+            if title in self.stat_arrays:
+                self.record('del', 'stat_arrays', title)
             cache_log.appendleft('Deleted data for: %s' % title)
             return True
         return False
 
     def toggle_preference(self, user):
         if user in self.python_preference:
-            self.python_preference.remove(user)
+            self.record('discard', 'python_preference', user)
         else:
-            self.python_preference.add(user)
+            self.record('add', 'python_preference', user)
         self.save()
         if user in self.python_preference:
             return True
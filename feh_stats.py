@@ -0,0 +1,101 @@
+import os
+import numpy as np
+from collections import OrderedDict
+
+# final stats of a hero for every rarity, merge level and summoner support of an IV, worked out in one go
+# from the cache's stat arrays the first time that hero and IV are asked for
+
+stats = ['HP', 'ATK', 'SPD', 'DEF', 'RES']
+merge_bonuses = [np.zeros(5), np.array([1,1,0,0,0]), np.array([1,1,1,1,0]), np.array([2,1,1,1,1]), np.array([2,2,2,1,1]), np.array([2,2,2,2,2]),
+                 np.array([3,3,2,2,2]), np.array([3,3,3,3,2]), np.array([4,3,3,3,3]), np.array([4,4,4,3,3]), np.array([4,4,4,4,4])]
+summoner_bonuses = {None:np.zeros(5), 'c':np.array([3,0,0,0,2]), 'b':np.array([4,0,0,2,2]), 'a':np.array([4,0,2,2,2]), 's':np.array([5,2,2,2,2])}
+# merged neutral units also get these, in the same order as the merge bonuses
+neutral_merge_bonus = np.array([1,1,1,0,0])
+
+# (boon, bane) pairs a stats query can ask for, merged units have no bane
+ivs = [(None, None)] + [(boon, None) for boon in stats] + [(boon, bane) for boon in stats for bane in stats if boon != bane]
+iv_index = {iv: i for i, iv in enumerate(ivs)}
+supports = [None, 'c', 'b', 'a', 's']
+# hero and IV slices kept around, each is 2*11*5*5*5 int32s (11 KB) so the default holds about 2.8 MB
+stat_engine_size = int(os.environ.get('FEH_STAT_ENGINE_SIZE', 256))
+
+
+def iv_columns():
+    # bane, neutral or boon column of each stat for every iv
+    columns = np.ones((len(ivs), 5), dtype=np.intp)
+    for i, (boon, bane) in enumerate(ivs):
+        if bane:
+            columns[i][stats.index(bane)] = 0
+        if boon:
+            columns[i][stats.index(boon)] = 2
+    return columns
+
+
+def build_tensor(arrays, iv):
+    # final stats of one iv as [base/max][merge][support][rarity][stat], and which rarities have unfilled stats
+    raw = np.array(arrays, dtype=np.int32)
+    # [base/max][rarity][stat]
+    selected = raw[:, :, iv_columns()[iv], np.arange(5)]
+    invalid = (selected < 0).any(axis=-1).any(axis=0)
+    available = selected[0].any(axis=-1)
+    # merge bonuses go to the highest base stats first, argsort ranks them the same way get_unit_stats did
+    order = (-selected[0]).argsort()
+    ranks = order.argsort()
+    merges = np.array(merge_bonuses, dtype=np.int32)
+    # [merge][rarity][stat]
+    bonuses = merges[:, ranks]
+    if ivs[iv] == (None, None):
+        bonuses[1:] += neutral_merge_bonus[ranks]
+    support_bonuses = np.array([summoner_bonuses[s] for s in supports], dtype=np.int32)
+    # [merge][support][rarity][stat]
+    total = bonuses[:, np.newaxis] + support_bonuses[np.newaxis, :, np.newaxis]
+    total *= available[:, np.newaxis]
+    tensor = selected[:, np.newaxis, np.newaxis] + total[np.newaxis]
+    return tensor, invalid
+
+
+class StatEngine(object):
+    """Looks up a hero's final stats in a tensor built from its stat arrays for the IV asked for. Tensors are
+    built when first needed, the least recently used are dropped past maxsize and a hero's are rebuilt after its
+    stats change."""
+
+    def __init__(self, stat_arrays, maxsize=stat_engine_size):
+        self.stat_arrays = stat_arrays
+        self.maxsize = maxsize
+        self.tensors = OrderedDict()
+
+    def tensor(self, title, iv):
+        key = (title, iv)
+        if key in self.tensors:
+            self.tensors.move_to_end(key)
+            return self.tensors[key]
+        arrays = self.stat_arrays.get(title)
+        if arrays is None:
+            return None
+        self.tensors[key] = build_tensor(arrays, iv)
+        while len(self.tensors) > self.maxsize:
+            self.tensors.popitem(last=False)
+        return self.tensors[key]
+
+    def discard(self, title):
+        for key in [key for key in self.tensors if key[0] == title]:
+            del self.tensors[key]
+
+    def clear(self):
+        self.tensors.clear()
+
+    def lookup(self, title, boon=None, bane=None, merge=None, support=None, rarity=None):
+        # base and max stats as get_unit_stats works them out, None when the hero has no stat arrays
+        if (boon, bane) not in iv_index or support not in supports:
+            return None
+        found = self.tensor(title, iv_index[(boon, bane)])
+        if found is None:
+            return None
+        tensor, invalid = found
+        if invalid.any() if rarity is None else invalid[rarity - 1]:
+            raise ValueError('This hero does not appear to have stats yet.')
+        base_stats, max_stats = tensor[:, merge or 0, supports.index(support)].copy()
+        if rarity is not None:
+            base_stats[np.arange(5) != rarity - 1] = 0
+            max_stats[np.arange(5) != rarity - 1] = 0
+        return base_stats, max_stats
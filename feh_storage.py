@@ -0,0 +1,522 @@
+import os, json, sqlite3, threading, time, urllib.request, jsonpickle, cloudinary, cloudinary.uploader, cloudinary.api
+import jsonpickle.ext.numpy as jsonpickle_numpy
+jsonpickle_numpy.register_handlers()
+from collections.abc import MutableMapping
+
+filename = './data_cache.json'
+journal_filename = './data_cache.journal'
+database_filename = './data_cache.db'
+# number of changes to collect before folding them into a new snapshot
+journal_limit = 200
+# seconds without new changes before a save is written, and the longest a change can wait to be written
+save_quiet_period = float(os.environ.get('FEH_SAVE_QUIET_PERIOD', 5))
+save_max_delay = float(os.environ.get('FEH_SAVE_MAX_DELAY', 60))
+
+persistent_fields = ['aliases', 'sons', 'waifus', 'flaunts', 'python_preference', 'replacement_list',
+                     'data', 'categories', 'list', 'last_update', 'icons', 'stat_arrays']
+
+
+def apply_record(cache, op, field, key=None, value=None):
+    # journal records are idempotent so replaying one twice is harmless
+    if op == 'set':
+        getattr(cache, field)[key] = value
+    elif op == 'del':
+        getattr(cache, field).pop(key, None)
+    elif op == 'add':
+        getattr(cache, field).add(key)
+    elif op == 'discard':
+        getattr(cache, field).discard(key)
+    elif op == 'assign':
+        setattr(cache, field, value)
+
+
+def download(public_id):
+    web_copy = cloudinary.api.resource(public_id, resource_type='raw')['url']
+    return urllib.request.urlopen(web_copy).read()
+
+
+def upload(contents, public_id):
+    cloudinary.uploader.upload(contents, resource_type='raw', public_id=public_id, invalidate=True)
+
+
+class SaveScheduler(object):
+    """Coalesces save requests into a single write on a background thread. A write happens once no
+    request has come in for quiet_period seconds, or max_delay seconds after the first unwritten request."""
+
+    def __init__(self, save, quiet_period=save_quiet_period, max_delay=save_max_delay):
+        self.save = save
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.first_request = None
+        self.last_request = None
+        self.thread = None
+
+    def request(self):
+        with self.condition:
+            now = time.monotonic()
+            if self.first_request is None:
+                self.first_request = now
+            self.last_request = now
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if self.first_request is None:
+                    self.condition.wait()
+                    continue
+                due = min(self.last_request + self.quiet_period, self.first_request + self.max_delay)
+                now = time.monotonic()
+                if now < due:
+                    self.condition.wait(due - now)
+                    continue
+                self.first_request = None
+                self.last_request = None
+            try:
+                self.save()
+            except Exception as ex:
+                print(ex)
+
+    def cancel(self):
+        # drop anything waiting, the caller is about to write it out itself
+        with self.condition:
+            self.first_request = None
+            self.last_request = None
+
+
+class JournalStorage(object):
+    """Keeps everything in memory, persisted as a jsonpickle snapshot plus an append-only journal."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.pending = []
+        self.journal_length = 0
+        self.compacting = False
+        self.compaction = None
+
+    def load(self, cache):
+        with self.lock:
+            self.pending = []
+            try:
+                #assert(False) # force local load
+                loaded = jsonpickle.decode(json.loads(download(filename[2:]).decode('utf-8')))
+                print("Loaded from the internet.")
+                cache.copy(loaded)
+                try:
+                    journal = download(journal_filename[2:]).decode('utf-8')
+                except Exception as ex:
+                    print(ex)
+                    journal = ''
+                # keep the local journal in step with the cloud copy so later uploads don't drop records
+                with open(journal_filename, 'w') as local_journal:
+                    local_journal.write(journal)
+                self.replay(cache, journal)
+                return True
+            except Exception as ex:
+                print(ex)
+                if os.path.exists(filename):
+                    print("Loaded from local.")
+                    with open(filename, 'r') as to_load:
+                        loaded = jsonpickle.decode(json.load(to_load))
+                        cache.copy(loaded)
+                    if os.path.exists(journal_filename):
+                        with open(journal_filename, 'r') as journal:
+                            self.replay(cache, journal.read())
+                    return True
+                else:
+                    return False
+
+    def replay(self, cache, journal):
+        self.journal_length = 0
+        for line in journal.splitlines():
+            if not line.strip():
+                continue
+            try:
+                apply_record(cache, *jsonpickle.decode(line))
+                self.journal_length += 1
+            except Exception as ex:
+                # a torn final write shouldn't stop the rest of the cache from loading
+                print(ex)
+        if self.journal_length:
+            print("Replayed %d journal records." % self.journal_length)
+
+    def record(self, cache, op, field, key=None, value=None):
+        self.pending.append((op, field, key, value))
+
+    def save(self, cache):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if not pending:
+                return
+            with open(journal_filename, 'a') as journal:
+                for record in pending:
+                    journal.write(jsonpickle.encode(list(record)) + '\n')
+            self.journal_length += len(pending)
+            should_compact = self.journal_length >= journal_limit and not self.compacting
+            if should_compact:
+                self.compacting = True
+        try:
+            self.upload_journal()
+        except Exception as ex:
+            print(ex)
+        if should_compact:
+            self.compaction = threading.Thread(target=self.compact, args=(cache,), daemon=True)
+            self.compaction.start()
+
+    def flush(self, cache):
+        # the journal is already uploaded by save(), just let a running compaction finish
+        self.save(cache)
+        if self.compaction is not None:
+            self.compaction.join()
+
+    def upload_journal(self):
+        with self.lock:
+            with open(journal_filename, 'rb') as journal:
+                contents = journal.read()
+        upload(contents, journal_filename[2:])
+
+    def compact(self, cache):
+        # fold the journal into a new snapshot, only the records written since the snapshot was taken are kept
+        try:
+            with self.lock:
+                snapshot = cache.__class__.__new__(cache.__class__)
+                for field in persistent_fields:
+                    value = getattr(cache, field)
+                    setattr(snapshot, field, value.copy() if hasattr(value, 'copy') else value)
+                covered = os.path.getsize(journal_filename) if os.path.exists(journal_filename) else 0
+                covered_length = self.journal_length
+            print("Saving cache and uploading to cloud...")
+            with open(filename + '.tmp', 'w+') as save_to:
+                json.dump(jsonpickle.encode(snapshot), save_to)
+            os.replace(filename + '.tmp', filename)
+            upload(filename, filename[2:])
+            with self.lock:
+                with open(journal_filename, 'rb') as journal:
+                    journal.seek(covered)
+                    remaining = journal.read()
+                with open(journal_filename, 'wb') as journal:
+                    journal.write(remaining)
+                self.journal_length -= covered_length
+            self.upload_journal()
+            print("Save complete!")
+        except Exception as ex:
+            print(ex)
+        finally:
+            self.compacting = False
+
+
+# a key removed from a SqliteMapping that the database still has
+deleted = object()
+
+
+class SqliteMapping(MutableMapping):
+    """A dict kept in SQLite. Writes wait in memory, where reads already see them, until the storage's
+    save writes them all in one transaction. The connection is shared with the save thread so every use
+    of it holds lock."""
+
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+        self.pending = {}
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.pending[key] if key in self.pending else self.read(key)
+        if value is deleted:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.pending[key] = value
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            self.pending[key] = deleted
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key] is not deleted
+            return self.contains(key)
+
+    def __iter__(self):
+        with self.lock:
+            keys = [key for key in self.stored_keys() if key not in self.pending]
+            keys += [key for key, value in self.pending.items() if value is not deleted]
+        return iter(keys)
+
+    def __len__(self):
+        with self.lock:
+            stored = sum(1 for key in self.pending if self.contains(key))
+            return self.count() - stored + sum(1 for value in self.pending.values() if value is not deleted)
+
+    def items(self):
+        with self.lock:
+            items = [(key, value) for key, value in self.stored_items() if key not in self.pending]
+            items += [(key, value) for key, value in self.pending.items() if value is not deleted]
+        return items
+
+    def update(self, other=(), **kwargs):
+        with self.lock:
+            self.pending.update(dict(other, **kwargs))
+
+    def copy(self):
+        return dict(self.items())
+
+    def write(self):
+        # runs inside the storage's transaction, pending is only cleared once that commits
+        self.store([(key, value) for key, value in self.pending.items() if value is not deleted])
+        self.remove([key for key, value in self.pending.items() if value is deleted])
+
+
+class SqliteDict(SqliteMapping):
+    """Items stored in a two column SQLite table."""
+
+    def __init__(self, connection, lock, table, key_column, value_column, encoded=True):
+        super().__init__(connection, lock)
+        self.table = table
+        self.key_column = key_column
+        self.value_column = value_column
+        self.encoded = encoded
+
+    def encode(self, value):
+        return jsonpickle.encode(value) if self.encoded else value
+
+    def decode(self, value):
+        return jsonpickle.decode(value) if self.encoded else value
+
+    def read(self, key):
+        row = self.connection.execute('SELECT {} FROM {} WHERE {} = ?'.format(
+            self.value_column, self.table, self.key_column), (key,)).fetchone()
+        return deleted if row is None else self.decode(row[0])
+
+    def contains(self, key):
+        return self.connection.execute('SELECT 1 FROM {} WHERE {} = ?'.format(
+            self.table, self.key_column), (key,)).fetchone() is not None
+
+    def stored_keys(self):
+        return [row[0] for row in self.connection.execute('SELECT {} FROM {}'.format(self.key_column, self.table))]
+
+    def stored_items(self):
+        return [(row[0], self.decode(row[1])) for row in self.connection.execute('SELECT {}, {} FROM {}'.format(
+            self.key_column, self.value_column, self.table)).fetchall()]
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM {}'.format(self.table)).fetchone()[0]
+
+    def store(self, items):
+        self.connection.executemany('INSERT OR REPLACE INTO {} ({}, {}) VALUES (?, ?)'.format(
+            self.table, self.key_column, self.value_column), [(k, self.encode(v)) for k, v in items])
+
+    def remove(self, keys):
+        self.connection.executemany('DELETE FROM {} WHERE {} = ?'.format(
+            self.table, self.key_column), [(k,) for k in keys])
+
+
+class SqliteCategories(SqliteMapping):
+    """Maps page titles to their ordered category lists, stored one membership per row."""
+
+    def read(self, title):
+        categories = [row[0] for row in self.connection.execute(
+            'SELECT category FROM categories WHERE title = ? ORDER BY position', (title,))]
+        return categories if categories else deleted
+
+    def contains(self, title):
+        return self.connection.execute('SELECT 1 FROM categories WHERE title = ?', (title,)).fetchone() is not None
+
+    def stored_keys(self):
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT title FROM categories')]
+
+    def stored_items(self):
+        stored = {}
+        for title, category in self.connection.execute('SELECT title, category FROM categories ORDER BY title, position'):
+            stored.setdefault(title, []).append(category)
+        return list(stored.items())
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(DISTINCT title) FROM categories').fetchone()[0]
+
+    def store(self, items):
+        self.remove([title for title, categories in items])
+        self.connection.executemany('INSERT INTO categories (title, position, category) VALUES (?, ?, ?)',
+                                    [(t, i, c) for t, categories in items for i, c in enumerate(categories)])
+
+    def remove(self, titles):
+        self.connection.executemany('DELETE FROM categories WHERE title = ?', [(t,) for t in titles])
+
+
+class SqliteStorage(object):
+    """Keeps pages, aliases and category memberships in indexed SQLite tables and only the small
+    per-user fields in memory. Changes wait in memory until the save scheduler's thread writes them in
+    one transaction and uploads the database file, so no command waits on the disk.
+    The heroes list and the per-user fields are written a row per key, so a change to one key writes one row."""
+
+    schema = [
+        'CREATE TABLE IF NOT EXISTS pages (title TEXT PRIMARY KEY, data TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, title TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS aliases_title ON aliases (title)',
+        'CREATE TABLE IF NOT EXISTS categories (title TEXT NOT NULL, position INTEGER NOT NULL, '
+        'category TEXT NOT NULL, PRIMARY KEY (title, position))',
+        'CREATE INDEX IF NOT EXISTS categories_category ON categories (category)',
+        'CREATE TABLE IF NOT EXISTS state (field TEXT PRIMARY KEY, value TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS state_items (field TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+        'PRIMARY KEY (field, key))',
+        'CREATE TABLE IF NOT EXISTS icons (file TEXT PRIMARY KEY, url TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS stat_arrays (title TEXT PRIMARY KEY, arrays TEXT NOT NULL)'
+    ]
+    table_fields = ['data', 'aliases', 'categories', 'icons', 'stat_arrays']
+    # dict and set fields kept in memory but stored a key per row, sets are stored with null values
+    keyed_fields = ['sons', 'waifus', 'flaunts', 'python_preference', 'replacement_list', 'list']
+
+    def __init__(self, database=database_filename):
+        self.lock = threading.RLock()
+        self.database = database
+        self.connection = None
+        self.mappings = []
+        # records of the fields outside the tables, written by the next save
+        self.pending = []
+        # transactions written and how many of them the last upload had
+        self.written = 0
+        self.uploaded = 0
+
+    def connect(self):
+        if self.connection is not None:
+            self.connection.close()
+        if not os.path.exists(self.database):
+            try:
+                contents = download(self.database[2:])
+                with open(self.database, 'wb') as local_copy:
+                    local_copy.write(contents)
+                print("Loaded database from the internet.")
+            except Exception as ex:
+                print(ex)
+        self.connection = sqlite3.connect(self.database, check_same_thread=False)
+        with self.connection:
+            for statement in self.schema:
+                self.connection.execute(statement)
+
+    def table_mappings(self):
+        return [('data', SqliteDict(self.connection, self.lock, 'pages', 'title', 'data')),
+                ('aliases', SqliteDict(self.connection, self.lock, 'aliases', 'alias', 'title', encoded=False)),
+                ('categories', SqliteCategories(self.connection, self.lock)),
+                ('icons', SqliteDict(self.connection, self.lock, 'icons', 'file', 'url', encoded=False)),
+                ('stat_arrays', SqliteDict(self.connection, self.lock, 'stat_arrays', 'title', 'arrays'))]
+
+    def load(self, cache):
+        with self.lock:
+            self.connect()
+            self.pending = []
+            if self.connection.execute('SELECT COUNT(*) FROM state').fetchone()[0] == 0:
+                # first run, migrate whatever the snapshot storage has
+                print("Migrating cache into %s..." % self.database)
+                if not JournalStorage().load(cache):
+                    cache.copy(object())
+                self.import_cache(cache)
+            loaded = cache.__class__.__new__(cache.__class__)
+            for field, value in self.connection.execute('SELECT field, value FROM state').fetchall():
+                setattr(loaded, field, jsonpickle.decode(value))
+                # databases from before state_items kept these whole, move them to a row per key
+                # fields already stored by key only have an empty marker here
+                if field in self.keyed_fields and isinstance(getattr(loaded, field), (dict, set)) and\
+                        getattr(loaded, field):
+                    with self.connection:
+                        self.write_items(field, getattr(loaded, field))
+            items = {}
+            for field, key, value in self.connection.execute('SELECT field, key, value FROM state_items'):
+                items.setdefault(field, {})[jsonpickle.decode(key)] = jsonpickle.decode(value)
+            for field in items:
+                setattr(loaded, field, set(items[field]) if field in ['python_preference', 'replacement_list']
+                        else items[field])
+            cache.copy(loaded)
+            self.mappings = []
+            for field, mapping in self.table_mappings():
+                setattr(cache, field, mapping)
+                self.mappings.append(mapping)
+            return True
+
+    def import_cache(self, cache):
+        with self.connection:
+            for field, mapping in self.table_mappings():
+                mapping.update(getattr(cache, field))
+                mapping.write()
+            for field in persistent_fields:
+                if field not in self.table_fields:
+                    self.write_state(cache, field)
+
+    def write_state(self, cache, field):
+        value = getattr(cache, field)
+        if field in self.keyed_fields and isinstance(value, (dict, set)):
+            self.write_items(field, value)
+            return
+        self.connection.execute('DELETE FROM state_items WHERE field = ?', (field,))
+        self.connection.execute('INSERT OR REPLACE INTO state (field, value) VALUES (?, ?)',
+                                (field, jsonpickle.encode(value)))
+
+    def write_items(self, field, value):
+        # replaces every row of a keyed field, the state table only keeps an empty one of its type
+        items = value.items() if isinstance(value, dict) else ((key, None) for key in value)
+        self.connection.execute('DELETE FROM state_items WHERE field = ?', (field,))
+        self.connection.executemany('INSERT INTO state_items (field, key, value) VALUES (?, ?, ?)',
+                                    [(field, jsonpickle.encode(k), jsonpickle.encode(v)) for k, v in items])
+        self.connection.execute('INSERT OR REPLACE INTO state (field, value) VALUES (?, ?)',
+                                (field, jsonpickle.encode(value.__class__())))
+
+    def write_item(self, field, key, value=None, delete=False):
+        if delete:
+            self.connection.execute('DELETE FROM state_items WHERE field = ? AND key = ?',
+                                    (field, jsonpickle.encode(key)))
+        else:
+            self.connection.execute('INSERT OR REPLACE INTO state_items (field, key, value) VALUES (?, ?, ?)',
+                                    (field, jsonpickle.encode(key), jsonpickle.encode(value)))
+
+    def write_record(self, cache, op, field, key=None, value=None):
+        # keyed fields only write the key that changed, the rest are written whole
+        if field in self.keyed_fields and op in ['set', 'add']:
+            self.write_item(field, key, value)
+        elif field in self.keyed_fields and op in ['del', 'discard']:
+            self.write_item(field, key, delete=True)
+        else:
+            self.write_state(cache, field)
+
+    def record(self, cache, op, field, key=None, value=None):
+        # table fields already wait in their mapping
+        if field not in self.table_fields:
+            self.pending.append((op, field, key, value))
+
+    def save(self, cache):
+        # runs on the save scheduler's thread, everything waiting goes in one transaction and the file is uploaded
+        with self.lock:
+            pending = self.pending
+            mappings = [mapping for mapping in self.mappings if mapping.pending]
+            if pending or mappings:
+                with self.connection:
+                    for mapping in mappings:
+                        mapping.write()
+                    for record in pending:
+                        self.write_record(cache, *record)
+                self.pending = []
+                for mapping in mappings:
+                    mapping.pending.clear()
+                self.written += 1
+            if self.uploaded == self.written:
+                return
+            written = self.written
+            # the lock keeps other writes out so the file on disk is consistent
+            with open(self.database, 'rb') as database:
+                contents = database.read()
+        upload(contents, self.database[2:])
+        with self.lock:
+            self.uploaded = max(self.uploaded, written)
+
+    def flush(self, cache):
+        self.save(cache)
+
+
+storage_backends = {'journal': JournalStorage, 'sqlite': SqliteStorage}
@@ -0,0 +1,412 @@
+import urllib.parse
+from lxml import etree, html as lhtml
+from fehwiki_parse import feh_source, weapon_colours, passive_colours, shorten_hero_name, get_bst, weapon_colour
+import fehwiki_parse
+
+# the same extraction as fehwiki_parse.parse_data on lxml's own tree with precompiled xpaths,
+# every function here returns exactly what its BeautifulSoup namesake does
+
+
+def with_class(tag, name):
+    return etree.XPath(".//%s[contains(concat(' ', normalize-space(@class), ' '), ' %s ')]" % (tag, name))
+
+
+wikitables = with_class('table', 'wikitable')
+skills_tables = with_class('table', 'skills-table')
+sortable_tables = with_class('table', 'sortable')
+hero_infoboxes = with_class('*', 'hero-infobox')
+infobox_divs = with_class('div', 'hero-infobox')
+tooltips = with_class('div', 'tooltiptext')
+# BeautifulSoup matches a class with a space in it against the whole attribute
+refinery_tables = etree.XPath(".//table[normalize-space(@class) = 'wikitable default']")
+tables = etree.XPath('.//table')
+rows = etree.XPath('.//tr')
+cells = etree.XPath('.//td')
+spanning_cells = etree.XPath('.//td[@rowspan]')
+headings = etree.XPath('.//th')
+links = etree.XPath('.//a')
+images = etree.XPath('.//img')
+paragraphs = etree.XPath('.//p')
+italics = etree.XPath('.//i')
+audio = etree.XPath('.//audio')
+breaks = etree.XPath('.//br')
+# pages of these categories go through extract_data
+extracted_categories = ['Heroes', 'Enemy units', 'Weapons', 'Passives', 'Specials', 'Assists']
+# get_text leaves out scripts and styles unless it is called on one
+visible_text = etree.XPath('.//text()[not(ancestor::script) and not(ancestor::style)]', smart_strings=False)
+all_text = etree.XPath('string()', smart_strings=False)
+
+
+def text(element):
+    if element.tag in ['script', 'style']:
+        return all_text(element)
+    return ''.join(visible_text(element))
+
+
+def first(xpath, element):
+    found = xpath(element)
+    return found[0] if found else None
+
+
+def title(a):
+    if 'title' not in a.attrib:
+        raise KeyError('title')
+    return a.get('title')
+
+
+def page_html(info):
+    categories = [' '.join(k['*'].split('_')) for k in info['parse']['categories']]
+    return categories, lhtml.document_fromstring(info['parse']['text']['*'])
+
+
+def inherit_text(element):
+    anchors = links(element)
+    return text(element).strip() + " " + ((', '.join([title(a) for a in anchors])).strip() if anchors else '')
+
+
+def parse_inherit_restriction(inherit_r):
+    try:
+        inherit_r = inherit_text(inherit_r)
+    except KeyError:
+        # maybe a html error
+        try:
+            inherit_r = text(inherit_r).strip()
+            inherit_r = inherit_text(lhtml.document_fromstring(inherit_r)) if inherit_r else ' '
+        except KeyError:
+            inherit_r = "*Inherit restrictions could not be parsed at this time. Please refer to the source page.*"
+    return inherit_r
+
+
+def get_infobox(html):
+    table = first(tables, first(infobox_divs, html))
+    return {text(first(headings, a)).replace('  ', ' ').strip() if headings(a) else None:
+            text(first(cells, a)).strip() if cells(a) else None for a in rows(table) if not audio(a)}
+
+
+def get_hero_infobox(html):
+    return {(text(first(headings, r)).strip().lower() if headings(r) else None):
+            (text(first(cells, r)).replace('  ', ' ').strip() if cells(r) else None) for r in rows(first(hero_infoboxes, html))}
+
+
+def get_heroes_stats_tables(html):
+    stats_tables = [table for table in wikitables(html) if 'Rarity' in text(table)]
+    if len(stats_tables) < 2:
+        return [None, None]
+    return [extract_table(a, cap_keys=True) for a in stats_tables[0:2]]
+
+
+def extract_table(table_html, get_image_url=False, cap_keys=False):
+    table = []
+    table_headings = [text(a).strip() for a in headings(table_html)]
+    for learner in rows(table_html):
+        learner_cells = cells(learner)
+        if len(learner_cells) == 0:
+            continue
+        data = []
+        for a in learner_cells:
+            d = text(a).strip()
+            anchors = links(a)
+            if get_image_url and anchors:
+                d += '|' + '|'.join([b.get('href').strip().lstrip('/').\
+                                    replace('File:','').replace('.png','').replace('_', ' ')
+                                     for b in anchors]) + '|'
+            data.append(d)
+        table.append({(table_headings[a].upper() if cap_keys else table_headings[a]): data[a] for a in range(0, len(table_headings))})
+    return table
+
+
+def get_learners(learners_table, skill_name):
+    learners = {i+1:[] for i in range(5)}
+    for l_data in [cells(a) for a in rows(learners_table)]:
+        if l_data:
+            for i in range(len(l_data)):
+                cell_text = text(l_data[i])
+                if skill_name in cell_text and cell_text[-1].isdigit():
+                    learned_level = int(cell_text[-1])
+                    learners[learned_level].append(shorten_hero_name(text(links(l_data[0])[1]).replace('\n', ' ')))
+                    break
+    learners = '\n'.join(['%d★: %s' % (level, ', '.join(learners[level])) for level in learners if len(learners[level]) != 0])
+    return learners
+
+
+def parse_data(arg, info, known_learners=None):
+    # only the heroes, weapons and skills pages are worth a second engine, the rest are short and go to BeautifulSoup
+    # so does any page this one can't handle, which keeps errors and odd pages identical to the other engine
+    categories = [' '.join(k['*'].split('_')) for k in info['parse']['categories']]
+    if not any(c in categories for c in extracted_categories):
+        return fehwiki_parse.parse_data(arg, info, known_learners)
+    try:
+        return extract_data(arg, info, known_learners)
+    except Exception:
+        return fehwiki_parse.parse_data(arg, info, known_learners)
+
+
+def extract_data(arg, info, known_learners=None):
+    categories, html = page_html(info)
+    for br in breaks(html):
+        br.tail = '\n' + (br.tail or '')
+    data = {'Embed Info': {'Title': arg, 'Icon': None}}
+    other_referenced_pages = []
+    icon_wants = []
+    if 'Heroes' in categories or 'Enemy units' in categories:
+        first_table = wikitables(html)[0]
+        first_cell = first(cells, first_table)
+        page_italics = italics(html)
+        if text(first_table).strip().startswith('You may') and first_cell is not None:
+            alts = [text(a).strip() for a in tooltips(first_cell) if text(a)]
+            data['Message'] = '**You may be looking for:** '+ ', '.join(alts)
+            other_referenced_pages.extend(set(alts))
+        elif any(['This page is about' in text(content) for content in page_italics]):
+            alts = [text(content) for content in page_italics if 'This page is about' in text(content)][0]
+            data['Message'] = '*' + alts.strip() + '*'
+        stats = get_hero_infobox(html)
+        if 'Legendary Heroes' in categories:
+            data['2Element'] = "{} ({})".format(stats['effect'].strip(), stats['ally boost']), False
+        base_stats_table, max_stats_table = get_heroes_stats_tables(html)
+        colour = weapon_colours['Colourless']
+        if any(i in stats['weapon type'] for i in ['Red', 'Sword']):
+            colour = weapon_colours['Red']
+        if any(i in stats['weapon type'] for i in ['Blue', 'Lance']):
+            colour = weapon_colours['Blue']
+        if any(i in stats['weapon type'] for i in ['Green', 'Axe']):
+            colour = weapon_colours['Green']
+        data['Embed Info']['Colour'] = colour
+        data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
+        icon_wants.append((('Embed Info',), 'Icon', (''.join(filter(lambda x: x.isalpha() or x in [' ', '-'], arg)), "", "_Face_FC")))
+        if 'rarities' in stats:
+            rarity = '-'.join(a+'★' for a in stats['rarities'] if a.isdigit())
+            data['0Rarities'] = (rarity if rarity else 'N/A'), True
+        bst = get_bst(max_stats_table)
+        if bst is not None:
+            data['1BST'] = bst, True
+        data['2Weapon Type'] = stats['weapon type'], True
+        data['3Move Type'] = stats['move type'], True
+        if base_stats_table:
+            data['4Base Stats'] = base_stats_table, False
+        if max_stats_table:
+            data['5Max Level Stats'] = max_stats_table, False
+        skills = ''
+        learnset = []
+        for table in skills_tables(html):
+            table_headings = [text(a).strip() for a in headings(table)]
+            section = None
+            if 'Might' in table_headings:
+                skills += '**Weapons:** '
+                section = 'Weapons'
+            elif 'Range' in table_headings:
+                skills += '**Assists:** '
+                section = 'Assists'
+            elif 'Cooldown' in table_headings:
+                skills += '**Specials:** '
+                section = 'Specials'
+            last_learned = None
+            in_passives = False
+            for row in rows(table)[1:]:
+                row_cells = cells(row)
+                if row_cells:
+                    slot = first(spanning_cells, row)
+                    if not slot is None:
+                        in_passives = True
+                        skills = skills.rstrip(', ')
+                        if not last_learned is None:
+                            skills += last_learned
+                        skills += '\n**' + text(slot) + ':** '
+                        section = text(slot)
+                    skill_cell = row_cells[1 if in_passives else 0]
+                    skills += text(skill_cell).strip()
+                    other_referenced_pages.append(links(skill_cell)[0].get('href').lstrip('/').replace('_',' '))
+                    learned = text(row_cells[-2 if not slot is None else -1]).strip()
+                    last_learned = ' (%s★)' % learned
+                    learnset.append((text(skill_cell).strip(), other_referenced_pages[-1],
+                                     int(learned) if learned.isdigit() else None, section))
+                    skills += ', '
+            if skills:
+                skills = skills.rstrip(', ') + last_learned + '\n'
+        if skills:
+            data['6Learnable Skills'] = skills, False
+        if learnset:
+            data['Skills'] = learnset
+
+    elif 'Weapons' in categories:
+        data['Embed Info']['Colour'] = weapon_colour(categories)
+        data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
+        icon_wants.append((('Embed Info',), 'Icon', (arg, "Weapon_")))
+        stats = get_infobox(html)
+        if 'Might' in stats and stats['Might']:
+            data['0Might'] = stats['Might'], True
+        if 'Range' in stats and stats['Range']:
+            data['1Range'] = stats['Range'], True
+        if 'SP' in stats and stats['SP']:
+            data['2SP Cost'] = stats['SP'], False
+        if 'Exclusive?' in stats and stats['Exclusive?']:
+            data['3Exclusive?'] = stats['Exclusive?'], True
+        if 'Description' in stats:
+            data['5Description'] = stats['Description'].replace('  ', ' ').strip(), False
+        evolves = [p for p in paragraphs(html) if 'can be evolved from' in text(p)]
+        if evolves:
+            data['6Evolves from'] = text(links(evolves[0])[0]).strip(), False
+        learners_table = first(sortable_tables, html)
+        if known_learners and arg in known_learners:
+            data['6Heroes with ' + arg] = known_learners[arg], False
+        elif learners_table is not None:
+            learners = ', '.join(map(shorten_hero_name, [text(links(first(cells, a))[1]).replace('\n', ' ') for a in rows(learners_table)[1:]]))
+            if learners:
+                data['6Heroes with ' + arg] = learners, False
+        for refinery_table in refinery_tables(html):
+            if not text(refinery_table).strip().startswith('Language'):
+                refinery_table = extract_table(refinery_table, True)
+                if refinery_table:
+                    if 'Image' in refinery_table[0]:
+                        cost = refinery_table[0]['Cost'].split('|')
+                        if any(cost):
+                            cost_materials = cost[1:]
+                            cost = cost[0].split('\n')
+                            cost[1] = cost[1].strip().lstrip('SP') + ' ' + cost_materials[0].strip() + 's'
+                            cost[2] = cost[2].strip() + ' ' + cost_materials[1].strip() + 's'
+                            cost = ', '.join(cost)
+                        else:
+                            cost = 'Unknown'
+                        data['Evolution'] = refinery_table[0]['Name'].split('|')[0], False
+                        data['Evolution Cost'] = cost
+                    elif 'Type' in refinery_table[0]:
+                        data['Refine'] = []
+                        first_r = refinery_table[0]['Type'].split('|')[1]
+                        if not first_r.startswith('Attack') and not first_r.startswith('Wrathful'):
+                            icon_wants.append(((), 'Refine Icon', (first_r,)))
+                        for r in refinery_table:
+                            t = r['Type'].split('|')[1].rstrip(' W')
+                            s = r['Stats'].split('|')[0]
+                            e = r['Description'].split('|')[0].replace('  ', ' ')
+                            cost = r['Cost'].split('|')
+                            if any(cost):
+                                cost_materials = cost[1:]
+                                cost = cost[0].split(', ')
+                                cost[1] = cost[1].strip() + ' ' + cost_materials[0].strip() + 's'
+                                cost[2] = cost[2].strip() + ' ' + cost_materials[1].strip() + 's'
+                                cost = ', '.join(cost)
+                            else:
+                                cost = 'Unknown'
+                            data['Refine'].append({'Type':t if t else 'Unknown', 'Stats':s if s else 'No Stat Changes',
+                                                   'Effect':e if e else 'No Effect'})
+                            data['Refinery Cost'] = cost
+    elif 'Passives' in categories:
+        stats_table = skills_tables(html)[0]
+        stat_rows = rows(stats_table)[1:]
+        data = {'Embed Info': {'Title': arg}, 'Data': []}
+        inherit_r = None
+        last_row = text(stat_rows[-1]).strip()
+        if last_row.startswith("Cannot use:") or last_row.startswith("No restrictions.") or \
+                last_row.startswith("This skill can only") or last_row.startswith("Unknown"):
+            inherit_r = parse_inherit_restriction(stat_rows.pop())
+        # the learners table is the same for every row
+        learners_table = None
+        if 'Seal Exclusive Skills' not in categories:
+            learners_table = sortable_tables(html)
+            learners_table = learners_table[-1] if learners_table and learners_table[-1] is not stats_table else None
+        curr_row = 1 if len(stat_rows) == 2 else 0
+        for row in stat_rows:
+            temp_data = {'Embed Info': {'Title': arg, 'Icon': None}}
+            row_cells = cells(row)
+            stats = [text(a).strip() for a in row_cells]
+            stats = [a if a else 'N/A' for a in stats]
+            if stats[0] != 'N/A' and len(stats) > 5:
+                slot = stats.pop(0)
+            temp_data['Embed Info']['Colour'] = 0xe8e1c9 if len(stat_rows) == 1\
+                                        else passive_colours[curr_row]
+            curr_row += 1
+            skill_name = stats[1]
+            if known_learners and skill_name in known_learners:
+                learners = known_learners[skill_name]
+            else:
+                learners = get_learners(learners_table, skill_name) if learners_table is not None else None
+            temp_data['Embed Info']['Title'] = skill_name
+            temp_data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
+            icon_wants.append((('Data', len(data['Data']), 'Embed Info'), 'Icon', (stats[1],)))
+            temp_data['0Slot'] = (slot + ('/S' if 'Sacred Seals' in categories and slot != 'S' else '')), True
+            temp_data['1SP Cost'] = stats[2][4 if stats[2].startswith('30px') else 0:], True
+            temp_data['2Effect'] = stats[4].replace('\n', ' '), False
+            if len(stats) > 5:
+                inherit_r = parse_inherit_restriction(row_cells[-1])
+                if not inherit_r.startswith('No restrictions'):
+                    inherit_r = "Cannot use: " + inherit_r
+            temp_data['3Inherit Restrictions'] = inherit_r, True
+            if learners:
+                if 'Sacred Seals' in categories:
+                    learners = 'Available as Sacred Seal\n' + learners
+                temp_data['4Heroes with ' + arg] = learners, False
+            data['Data'].append(temp_data)
+    elif 'Specials' in categories or 'Assists' in categories:
+        stats_table = skills_tables(html)[0]
+        stats_rows = rows(stats_table)
+        stats = [text(a).strip() for a in cells(stats_rows[1])]
+        stats = [a if a else 'N/A' for a in stats]
+        if 'Specials' in categories:
+            data['Embed Info']['Colour'] = 0xf499fe
+        elif 'Assists' in categories:
+            data['Embed Info']['Colour'] = 0x1fe2c3
+
+        if 'Staff Assists' in categories:
+            icon_wants.append((('Embed Info',), 'Icon', (arg, "Weapon_")))
+
+        data['Embed Info']['Title'] = arg
+        data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
+        if 'Specials' in categories:
+            data['0Cooldown'] = stats[1], True
+        elif 'Assists' in categories:
+            data['0Range'] = stats[1], True
+        data['1SP Cost'] = stats[3], True
+        data['2Effect'] = stats[2], False
+        data['3Prequirement'] = stats[-1].replace('\n', ', '), False
+        data['4Inherit Restrictions'] = parse_inherit_restriction(stats_rows[-1]), True
+        if 'Specials' in categories:
+            if 'Area of Effect Specials' in categories:
+                range = ''
+                for row in rows(wikitables(html)[1]):
+                    for d in cells(row):
+                        image = first(images, d)
+                        if image is not None:
+                            if 'Special' in image.attrib['alt']:
+                                range += 'X'
+                            else:
+                                range += 'O'
+                        else:
+                            range += ' '
+                    range += '\n'
+                data['3Area of Effect'] = '```' + range + '```', False
+        if known_learners and stats[0] in known_learners:
+            learners = known_learners[stats[0]]
+        else:
+            learners = get_learners(sortable_tables(html)[-1], stats[0])
+        if learners:
+            data['5Heroes with ' + arg] = learners, False
+
+    return categories, data, other_referenced_pages, icon_wants, None
+
+
+def list_row_to_dict(row):
+    data = cells(row)
+    colour, weapon = row.attrib['data-weapon-type'].split()
+    # indexed one by one so a short row raises IndexError like the bs4 parser does
+    stats = [text(data[i]) for i in range(4, 10)]
+    stats = [int(stat) if stat.isdigit() else 0 for stat in stats]
+    hero = {
+        'Name':text(data[1]),
+        'Colour':colour,
+        'Weapon':weapon,
+        'Movement':row.attrib['data-move-type'],
+        'HP':stats[0], 'ATK':stats[1], 'SPD':stats[2], 'DEF':stats[3], 'RES':stats[4], 'BST':stats[5]
+    }
+    return hero
+
+
+def parse_heroes_list(info):
+    categories, html = page_html(info)
+    heroes_list = []
+    for row in rows(tables(html)[-1]):
+        try:
+            heroes_list.append(list_row_to_dict(row))
+        except KeyError:
+            pass
+    heroes_list = list(filter(lambda h:h['BST'] != 0, heroes_list))
+    heroes_list = {r['Name']: r for r in heroes_list}
+    return heroes_list
@@ -1,6 +1,10 @@
-import urllib.request, urllib.parse, json, io, operator, unidecode
-from socket import timeout
+import os, urllib.request, urllib.parse, io, operator, unidecode
+from collections import Counter
+from difflib import SequenceMatcher
 from bs4 import BeautifulSoup as BSoup
+from http_client import fetch, fetch_json, forget
+from caches import single_flight
+from parse_pool import parse
 from feh_alias import *
 from feh_personal import *
 
@@ -10,8 +14,27 @@ GAUNTLET_URL = "https://support.fire-emblem-heroes.com/voting_gauntlet/current"
 
 weapon_colours = {'Red':0xCC2844, 'Blue':0x2A63E6, 'Green':0x139F13, 'Colourless':0x54676E, 'Null':0x222222}
 passive_colours = [0xcd914c, 0xa8b0b0, 0xd8b956, 0xfff208]
+# the page the heroes list for ?list comes from
+heroes_list_page = 'Level 40 stats table'
 valid_categories = ['Heroes', 'Passives', 'Weapons', 'Specials', 'Assists', 'Disambiguation pages', 'Enemy units']
 
+# seconds get_page serves each kind of request from the response cache before revalidating it
+# parses are also dropped as soon as recentchanges reports an edit, recentchanges itself is never cached
+response_ttls = {endpoint: int(os.environ.get('FEH_HTTP_TTL_' + endpoint.upper(), default)) for endpoint, default in
+                 [('parse', 86400), ('imageinfo', 600), ('opensearch', 300), ('cargoquery', 3600), ('categorymembers', 3600)]}
+
+# 'bs4' parses pages with BeautifulSoup, 'lxml' with the xpath engine in fehwiki_lxml
+parser_engine = os.environ.get('FEH_PARSER', 'bs4')
+# build single skill pages from their much smaller wikitext first, see fehwiki_wikitext
+wikitext_first = os.environ.get('FEH_WIKITEXT', '') == '1'
+
+# how find_name answered each lookup, shown by ?feh -resolverstats
+resolution_stats = Counter()
+# fuzzy matches need a query at least this long, this close to an alias and this far ahead of any other page
+local_min_length = 6
+local_min_ratio = 0.9
+local_min_margin = 0.05
+
 
 def shorten_hero_name(name):
     main_name, epithet = name.split(':')
@@ -34,14 +57,106 @@ def parse_inherit_restriction(inherit_r):
             inherit_r = "*Inherit restrictions could not be parsed at this time. Please refer to the source page.*"
     return inherit_r
 
-def get_data(arg, timeout_dur=5):
-    categories, html = get_page_html(arg, timeout_dur)
-    if html is None:
-        return None, None, None
+# the timeout and the cache passed don't change which page is fetched, so every caller of a title shares one call
+@single_flight(key=lambda arg, *args, **kwargs: arg)
+async def get_data(arg, timeout_dur=5, cache=None):
+    # learner fields come from the cached heroes once all of them are cached
+    known_learners = cache.skill_index.page_learners(arg, cache.list) if cache is not None else None
+    parsed = None
+    # the wikitext has no learners table, so only pages whose one skill is already indexed try it
+    if wikitext_first and known_learners is not None and list(known_learners) == [arg]:
+        parsed = await get_wikitext_data(arg, known_learners, timeout_dur)
+    if parsed is None:
+        info = await get_page(parse_url(arg), 'text|categories', timeout_dur)
+        if not info:
+            return None, None, None
+        parsed = await parse(get_parsers()[0], arg, info, known_learners)
+    categories, data, other_referenced_pages, icon_wants, follow = parsed
+    if follow is not None:
+        kind, title = follow
+        if kind == 'redirect':
+            return await get_data(title, timeout_dur=timeout_dur, cache=cache)
+        elif kind == 'person':
+            new_categories, new_data, other_pages = await get_data(title, timeout_dur=timeout_dur, cache=cache)
+            if new_categories is None:
+                return ['Persons'], data, other_referenced_pages
+            else:
+                return new_categories, new_data, other_pages
+        elif kind == 'category':
+            page = await get_page(
+                'http://feheroes.gamepedia.com/api.php?action=query&list=categorymembers&cmtitle={}&cmlimit=500&cmtype=page&cmcontinue'.format(
+                    urllib.parse.quote(title)))
+            members = page['query']['categorymembers']
+            while 'continue' in page:
+                page = await get_page(
+                    'http://feheroes.gamepedia.com/api.php?action=query&list=categorymembers&cmtitle={}&cmlimit=500&cmtype=page&cmcontinue={}'.format(
+                        urllib.parse.quote(title), page['continue']['cmcontinue']))
+                members.extend(page['query']['categorymembers'])
+            data['1Total Pages'] = len(members), False
+            # num_pages = 0
+            # items_per_page = 25
+            # while num_pages * items_per_page < len(members) and num_pages < 3:
+            #     start = num_pages * items_per_page
+            #     end = start + items_per_page
+            #     data['2Pages {}-{}'.format(start+1, min(end, len(members)))] = '\n'.join([m['title'] for m in members[start:end]]), True
+            #     num_pages += 1
+            data['2First 20 Pages'] = '\n'.join([m['title'] for m in members[:20]]), True
+
+    if icon_wants:
+        icons = await get_icons([icon for path, key, icon in icon_wants], cache)
+        for (path, key, icon), url in zip(icon_wants, icons):
+            if url:
+                target = data
+                for step in path:
+                    target = target[step]
+                target[key] = url
+
+    return categories, data, other_referenced_pages
+
+
+async def get_wikitext_data(arg, known_learners, timeout_dur=5):
+    # None when the page needs the rendered HTML
+    import fehwiki_wikitext
+    info = await get_page(parse_url(arg), 'wikitext|categories', timeout_dur)
+    if not info:
+        return None
+    return await parse(fehwiki_wikitext.parse_data, arg, info, known_learners)
+
+
+def weapon_colour(categories):
+    colour = weapon_colours['Null'] # for dragonstones and bows, which are any colour
+    if any(i in ['Swords', 'Red Tomes'] for i in categories):
+        colour = weapon_colours['Red']
+    elif any(i in ['Lances', 'Blue Tomes'] for i in categories):
+        colour = weapon_colours['Blue']
+    elif any(i in ['Axes', 'Green Tomes'] for i in categories):
+        colour = weapon_colours['Green']
+    elif any(i in ['Staves', 'Daggers'] for i in categories):
+        colour = weapon_colours['Colourless']
+    return colour
+
+
+def get_parsers():
+    # the page and heroes list parsers of the configured engine
+    if parser_engine == 'lxml':
+        # builds on the helpers here so it can only be imported once this module is
+        import fehwiki_lxml
+        return fehwiki_lxml.parse_data, fehwiki_lxml.parse_heroes_list
+    return parse_data, parse_heroes_list
+
+
+def parse_data(arg, info, known_learners=None):
+    # everything get_data does that doesn't need another request, kept free of io so it can run in a worker process
+    # icons are left as (path, key, icon) wants, path being the keys from data to the dict the icon goes in
+    # follow is (kind, title) when the page only leads to another one
+    # known_learners is skill name to its learners field, those skills skip the page's learners table
+    categories, html = page_html(info)
     for br in html.find_all('br'):
         br.replace_with('\n')
     data = {'Embed Info': {'Title': arg, 'Icon': None}}
     other_referenced_pages = []
+    icon_wants = []
+    follow = None
     if 'Heroes' in categories or 'Enemy units' in categories:
         first_table = html.find('table', attrs={'class':'wikitable'})
         if first_table.text.strip().startswith('You may') and first_table.td is not None:
@@ -64,9 +179,7 @@ def get_data(arg, timeout_dur=5):
             colour = weapon_colours['Green']
         data['Embed Info']['Colour'] = colour
         data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
-        icon = get_icon(''.join(filter(lambda x: x.isalpha() or x in [' ', '-'], arg)), suffix="_Face_FC")
-        if not icon is None:
-            data['Embed Info']['Icon'] = icon
+        icon_wants.append((('Embed Info',), 'Icon', (''.join(filter(lambda x: x.isalpha() or x in [' ', '-'], arg)), "", "_Face_FC")))
         if 'rarities' in stats:
             rarity = '-'.join(a+'★' for a in stats['rarities'] if a.isdigit())
             data['0Rarities'] = (rarity if rarity else 'N/A'), True
@@ -81,17 +194,23 @@ def get_data(arg, timeout_dur=5):
             data['5Max Level Stats'] = max_stats_table, False
         skill_tables = html.find_all("table", attrs={"class":"skills-table"})
         skills = ''
+        # (skill, page, rarity it's learned at, weapons/assists/specials or passive slot) for the skill index, not shown
+        learnset = []
         for table in skill_tables:
             headings = [a.get_text().strip() for a in table.find_all("th")]
+            section = None
             if 'Might' in headings:
                 # weapons
                 skills += '**Weapons:** '
+                section = 'Weapons'
             elif 'Range' in headings:
                 # assists
                 skills += '**Assists:** '
+                section = 'Assists'
             elif 'Cooldown' in headings:
                 # specials
                 skills += '**Specials:** '
+                section = 'Specials'
             last_learned = None
             in_passives = False
             for row in table.find_all("tr")[1:]:
@@ -103,30 +222,25 @@ def get_data(arg, timeout_dur=5):
                         if not last_learned is None:
                             skills += last_learned
                         skills += '\n**' + slot.get_text() + ':** '
+                        section = slot.get_text()
                     skills += row.find_all("td")[1 if in_passives else 0].get_text().strip()
                     other_referenced_pages.append(row.find_all("td")[1 if in_passives else 0].a['href'].lstrip('/').replace('_',' '))
-                    last_learned = ' (%s★)' % row.find_all("td")[-2 if not slot is None else -1].get_text().strip() # get learned levels
+                    learned = row.find_all("td")[-2 if not slot is None else -1].get_text().strip()
+                    last_learned = ' (%s★)' % learned # get learned levels
+                    learnset.append((row.find_all("td")[1 if in_passives else 0].get_text().strip(), other_referenced_pages[-1],
+                                     int(learned) if learned.isdigit() else None, section))
                     skills += ', '
             if skills:
                 skills = skills.rstrip(', ') + last_learned + '\n'
         if skills:
             data['6Learnable Skills'] = skills, False
+        if learnset:
+            data['Skills'] = learnset
 
     elif 'Weapons' in categories:
-        colour = weapon_colours['Null'] # for dragonstones and bows, which are any colour
-        if any(i in ['Swords', 'Red Tomes'] for i in categories):
-            colour = weapon_colours['Red']
-        elif any(i in ['Lances', 'Blue Tomes'] for i in categories):
-            colour = weapon_colours['Blue']
-        elif any(i in ['Axes', 'Green Tomes'] for i in categories):
-            colour = weapon_colours['Green']
-        elif any(i in ['Staves', 'Daggers'] for i in categories):
-            colour = weapon_colours['Colourless']
-        data['Embed Info']['Colour'] = colour
+        data['Embed Info']['Colour'] = weapon_colour(categories)
         data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
-        icon = get_icon(arg, "Weapon_")
-        if not icon is None:
-            data['Embed Info']['Icon'] = icon
+        icon_wants.append((('Embed Info',), 'Icon', (arg, "Weapon_")))
         stats = get_infobox(html)
         if 'Might' in stats and stats['Might']:
             data['0Might'] = stats['Might'], True
@@ -142,7 +256,9 @@ def get_data(arg, timeout_dur=5):
         if any(['can be evolved from' in p.text for p in ps]):
             data['6Evolves from'] = ps[ps.index([p for p in ps if 'can be evolved from' in p.text][0])].a.text.strip(), False
         learners_table = html.find("table", attrs={"class":"sortable"})
-        if learners_table:
+        if known_learners and arg in known_learners:
+            data['6Heroes with ' + arg] = known_learners[arg], False
+        elif learners_table:
             learners = ', '.join(map(shorten_hero_name, [a.find("td").find_all("a")[1].get_text().replace('\n', ' ') for a in learners_table.find_all("tr")[1:]]))
             if learners:
                 data['6Heroes with ' + arg] = learners, False
@@ -167,9 +283,7 @@ def get_data(arg, timeout_dur=5):
                         data['Refine'] = []
                         first_r = refinery_table[0]['Type'].split('|')[1]
                         if not first_r.startswith('Attack') and not first_r.startswith('Wrathful'):
-                            icon = get_icon(first_r)
-                            if icon:
-                                data['Refine Icon'] = icon
+                            icon_wants.append(((), 'Refine Icon', (first_r,)))
                         for r in refinery_table:
                             t = r['Type'].split('|')[1].rstrip(' W')
                             s = r['Stats'].split('|')[0]
@@ -209,7 +323,9 @@ def get_data(arg, timeout_dur=5):
             curr_row += 1
             skill_name = stats[1]
             learners = None
-            if 'Seal Exclusive Skills' not in categories:
+            if known_learners and skill_name in known_learners:
+                learners = known_learners[skill_name]
+            elif 'Seal Exclusive Skills' not in categories:
                 learners_table = html.find_all("table", attrs={"class": "sortable"})
                 if learners_table and len(learners_table) > 0:
                     learners_table = learners_table[-1]
@@ -217,9 +333,7 @@ def get_data(arg, timeout_dur=5):
                         learners = get_learners(learners_table, skill_name)
             temp_data['Embed Info']['Title'] = skill_name
             temp_data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
-            icon = get_icon(stats[1])
-            if not icon is None:
-                temp_data['Embed Info']['Icon'] = icon
+            icon_wants.append((('Data', len(data['Data']), 'Embed Info'), 'Icon', (stats[1],)))
             temp_data['0Slot'] = (slot + ('/S' if 'Sacred Seals' in categories and slot != 'S' else '')), True
             temp_data['1SP Cost'] = stats[2][4 if stats[2].startswith('30px') else 0:], True
             temp_data['2Effect'] = stats[4].replace('\n', ' '), False
@@ -244,9 +358,7 @@ def get_data(arg, timeout_dur=5):
             data['Embed Info']['Colour'] = 0x1fe2c3
 
         if 'Staff Assists' in categories:
-            icon = get_icon(arg, "Weapon_")
-            if not icon is None:
-                data['Embed Info']['Icon'] = icon
+            icon_wants.append((('Embed Info',), 'Icon', (arg, "Weapon_")))
 
         data['Embed Info']['Title'] = arg
         data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
@@ -275,7 +387,10 @@ def get_data(arg, timeout_dur=5):
                             range += ' '
                     range += '\n'
                 data['3Area of Effect'] = '```' + range + '```', False
-        learners = get_learners(html.find_all("table", attrs={"class":"sortable"})[-1], stats[0])
+        if known_learners and stats[0] in known_learners:
+            learners = known_learners[stats[0]]
+        else:
+            learners = get_learners(html.find_all("table", attrs={"class":"sortable"})[-1], stats[0])
         if learners:
             data['5Heroes with ' + arg] = learners, False
     else:
@@ -292,37 +407,17 @@ def get_data(arg, timeout_dur=5):
                 data['1Could refer to:'] = '\n'.join(options), False
             else:
                 # connect to the first one
-                return get_data(options[0], timeout_dur=timeout_dur)
+                follow = 'redirect', options[0]
         elif 'Persons' in categories:
                 first_hero_link = [a for a in html.find_all('a') if "title" in a.attrs and arg in a.text]
                 if first_hero_link:
-                    new_categories, new_data, other_pages = get_data(first_hero_link[0]["title"].strip(), timeout_dur=timeout_dur)
-                    if new_categories is None:
-                        return ['Persons'], data, other_referenced_pages
-                    else:
-                        return new_categories, new_data, other_pages
+                    follow = 'person', first_hero_link[0]["title"].strip()
         # check if soft redirect
         elif 'redirect' in html.text.strip().lower():
-            return get_data(html.a.text.strip(), timeout_dur=timeout_dur)
+            follow = 'redirect', html.a.text.strip()
         elif arg.startswith('Category:'):
-            page = get_page(
-                'http://feheroes.gamepedia.com/api.php?action=query&list=categorymembers&cmtitle={}&cmlimit=500&cmtype=page&cmcontinue'.format(
-                    urllib.parse.quote(arg)))
-            members = page['query']['categorymembers']
-            while 'continue' in page:
-                page = get_page(
-                    'http://feheroes.gamepedia.com/api.php?action=query&list=categorymembers&cmtitle={}&cmlimit=500&cmtype=page&cmcontinue={}'.format(
-                        urllib.parse.quote(arg), page['continue']['cmcontinue']))
-                members.extend(page['query']['categorymembers'])
-            data['1Total Pages'] = len(members), False
-            # num_pages = 0
-            # items_per_page = 25
-            # while num_pages * items_per_page < len(members) and num_pages < 3:
-            #     start = num_pages * items_per_page
-            #     end = start + items_per_page
-            #     data['2Pages {}-{}'.format(start+1, min(end, len(members)))] = '\n'.join([m['title'] for m in members[start:end]]), True
-            #     num_pages += 1
-            data['2First 20 Pages'] = '\n'.join([m['title'] for m in members[:20]]), True
+            # the member list needs more requests
+            follow = 'category', arg
         else:
             for b in html.find_all('b'):
                 b.replace_with('**{}**'.format(b.text))
@@ -336,38 +431,49 @@ def get_data(arg, timeout_dur=5):
 
             data['2Summary'] = html.p.text.strip()[:1000], False
 
-    return categories, data, other_referenced_pages
+    return categories, data, other_referenced_pages, icon_wants, follow
 
 
-def get_page(url, prop='', timeout_dur=5):
-    query_url = url+('&prop='+prop if prop else '')+'&format=json'
-    print(query_url)
-    request = urllib.request.Request(query_url, headers={'User-Agent': 'Mozilla/5.0'})
-    if timeout:
-        response = urllib.request.urlopen(request, timeout=timeout_dur)
-    else:
-        response = urllib.request.urlopen(request)
-    print('Loading JSON...')
-    info = json.load(response)
+def query_url(url, prop=''):
+    return url+('&prop='+prop if prop else '')+'&format=json'
+
+
+def response_ttl(url, prop=''):
+    if 'action=parse' in url:
+        return response_ttls['parse']
+    if prop.startswith('imageinfo'):
+        return response_ttls['imageinfo']
+    if 'action=opensearch' in url:
+        return response_ttls['opensearch']
+    if 'action=cargoquery' in url:
+        return response_ttls['cargoquery']
+    if 'list=categorymembers' in url:
+        return response_ttls['categorymembers']
+    return None
+
+
+async def get_page(url, prop='', timeout_dur=5):
+    print(query_url(url, prop))
+    info = await fetch_json(query_url(url, prop), timeout_dur=timeout_dur, ttl=response_ttl(url, prop))
     if 'error' in info:
         return None
     return info
 
 
-def find_name(arg, cache, ctx=None):
+async def find_name(arg, cache, ctx=None):
     # check if the arg is son or waifu and sees if the user has one
     sender = ctx.message.author if ctx else None
     if sender:
         if arg.lower() in ['son', 'my son']:
             if str(sender) in cache.sons:
                 cache.set_fam('son', str(sender.id), cache.sons[str(sender)])
-                del cache.sons[str(sender)]
+                cache.set_fam('son', str(sender), None)
             if str(sender.id) in cache.sons:
                 return cache.sons[str(sender.id)]
         elif arg.lower() in ['waifu', 'my waifu']:
             if str(sender) in cache.waifus:
                 cache.set_fam('waifu', str(sender.id), cache.waifus[str(sender)])
-                del cache.waifus[str(sender)]
+                cache.set_fam('waifu', str(sender), None)
             if str(sender.id) in cache.waifus:
                 return cache.waifus[str(sender.id)]
 
@@ -377,7 +483,15 @@ def find_name(arg, cache, ctx=None):
     # check cached aliases
     result = cache.resolve_alias(arg)
     if result:
+        resolution_stats['alias'] += 1
+        return result
+
+    # the cache may know the name under a slightly different spelling
+    result = resolve_locally(arg, cache)
+    if result:
+        resolution_stats['local'] += 1
         return result
+    resolution_stats['remote'] += 1
 
     # basic quick stat aliasing without needing manual input
     # enough to be vaguely useful without messing with some other skills
@@ -388,7 +502,7 @@ def find_name(arg, cache, ctx=None):
 
     # resolve webpage
     redirect = feh_source % "api.php?action=opensearch&search=%s&redirects=resolve" % (urllib.parse.quote(arg))
-    info = get_page(redirect)
+    info = await get_page(redirect)
     if not info[1] or not info[1][0]:
         return INVALID_HERO
     else:
@@ -396,9 +510,41 @@ def find_name(arg, cache, ctx=None):
     return arg
 
 
-def get_heroes_list():
+def normalize_name(arg):
+    return unidecode.unidecode(arg).lower().replace(' ', '').replace("'", '')
+
+
+def resolve_locally(arg, cache):
+    # returns a cached page title when one is a confident match, otherwise None so the wiki gets asked
+    query = normalize_name(arg)
+    if len(query) < 4:
+        return None
+    if query in cache.aliases:
+        return cache.aliases[query]
+    if len(query) < local_min_length:
+        return None
+    # an alias extending the query or extended by it is another page (Silver Sword and Silver Sword+,
+    # Lucina and Lucina: Glorious Archer) that may just not be cached yet, not a typo
+    scored = sorted(((SequenceMatcher(None, query, alias).ratio(), alias) for alias in cache.alias_index.shortlist(query)
+                     if not alias.startswith(query) and not query.startswith(alias)), reverse=True)
+    if not scored or scored[0][0] < local_min_ratio:
+        return None
+    best = cache.aliases[scored[0][1]]
+    runner_up = next((ratio for ratio, alias in scored[1:] if cache.aliases[alias] != best), 0)
+    if scored[0][0] - runner_up < local_min_margin:
+        return None
+    return best
+
+
+@single_flight
+async def get_heroes_list():
+    info = await get_page(parse_url(heroes_list_page), 'text|categories')
+    return await parse(get_parsers()[1], info)
+
+
+def parse_heroes_list(info):
     # get table from html
-    categories, html = get_page_html('Level 40 stats table')
+    categories, html = page_html(info)
     table = html.find_all('table')[-1]
     heroes_list = []
     # add all the rows that fit the format to current list
@@ -428,29 +574,58 @@ def list_row_to_dict(row):
     return hero
 
 
-def get_icon(arg, prefix="", suffix=""):
-    url = feh_source %\
-          "api.php?action=query&titles=File:%s%s%s.png" %\
-          (prefix, urllib.parse.quote(unidecode.unidecode(arg.replace('+', '_Plus' + '_' if not prefix == "Weapon_" else '_Plus'))), suffix)
-    info = get_page(url, 'imageinfo&iiprop=url')
-    if '-1' in info['query']['pages']:
-        if "'" in arg:
-            return get_icon(arg.replace("'",""), prefix, suffix)
-        return None
-    else:
-        icon = info['query']['pages'][next(iter(info['query']['pages']))]['imageinfo'][0]['url']
-        return icon
+def icon_files(arg, prefix="", suffix=""):
+    # the file titles an icon could be under, some files drop the apostrophes from the name
+    # titles are written the way the wiki normalizes them so they match what recentchanges reports
+    names = [arg] + ([arg.replace("'", "")] if "'" in arg else [])
+    files = []
+    for name in names:
+        file = ' '.join(('%s%s%s' % (prefix, unidecode.unidecode(name.replace('+', '_Plus' + '_' if not prefix == "Weapon_" else '_Plus')), suffix)).replace('_', ' ').split())
+        files.append('File:%s.png' % (file[:1].upper() + file[1:]))
+    return files
 
 
-def get_page_html(arg, timeout_dur=5):
-    url = feh_source % "api.php?action=parse&page=%s" % (urllib.parse.quote(arg))
-    info = get_page(url, 'text|categories', timeout_dur)
-    if info:
-        categories = [' '.join(k['*'].split('_')) for k in info['parse']['categories']]
-        soup = BSoup(info['parse']['text']['*'], "lxml")
-        return categories, soup
-    else:
-        return None, None
+@single_flight
+async def query_icons(files):
+    url = feh_source % "api.php?action=query&titles=%s" % urllib.parse.quote('|'.join(files))
+    info = await get_page(url, 'imageinfo&iiprop=url')
+    normalized = {n['to']: n['from'] for n in info['query'].get('normalized', [])}
+    found = {}
+    for page in info['query']['pages'].values():
+        found[normalized.get(page['title'], page['title'])] = page['imageinfo'][0]['url'] if 'imageinfo' in page else ''
+    # missing files are remembered as '' until recentchanges says they were uploaded
+    found.update({file: '' for file in files if file not in found})
+    return found
+
+
+async def get_icons(icons, cache=None):
+    # resolve (arg, prefix, suffix) icons with one imageinfo query, files already in cache.icons aren't asked for again
+    files = [icon_files(*icon) for icon in icons]
+    known = cache.icons if cache is not None else {}
+    found = {}
+    unknown = tuple(sorted({file for candidates in files for file in candidates if file not in known}))
+    if unknown:
+        found = await query_icons(unknown)
+        if cache is not None:
+            cache.set_icons(found)
+    return [next((known.get(file) or found.get(file) for file in candidates if known.get(file) or found.get(file)), None)
+            for candidates in files]
+
+
+def parse_url(arg):
+    return feh_source % "api.php?action=parse&page=%s" % (urllib.parse.quote(arg))
+
+
+def forget_page(arg):
+    # the next get_data of arg goes to the wiki instead of the response cache
+    forget(query_url(parse_url(arg), 'text|categories'))
+    forget(query_url(parse_url(arg), 'wikitext|categories'))
+
+
+def page_html(info):
+    categories = [' '.join(k['*'].split('_')) for k in info['parse']['categories']]
+    soup = BSoup(info['parse']['text']['*'], "lxml")
+    return categories, soup
 
 
 def get_infobox(html):
@@ -535,6 +710,41 @@ def get_bst(stats_table):
     return stats_table[-1]['TOTAL']
 
 
+def stats_table_to_ivs(table):
+    # [rarity][bane, neutral, boon][stat] from a stats table, rarities without a row are all 0
+    # and stats the wiki hasn't filled in are -1, None if the table can't be read
+    array = [[[0] * 5 for iv in range(3)] for rarity in range(5)]
+    keys = ['HP', 'ATK', 'SPD', 'DEF', 'RES']
+    try:
+        for row in table:
+            rarity = int(row['RARITY']) - 1
+            for i, key in enumerate(keys):
+                stat = row[key].split('/')
+                if any([not s.isdigit() for s in stat]):
+                    values = [-1, -1, -1]
+                elif len(stat) == 3:
+                    values = list(map(int, stat))
+                else:
+                    values = [int(stat[0])] * 3
+                for iv in range(3):
+                    array[rarity][iv][i] = values[iv]
+    except (KeyError, ValueError, IndexError, AttributeError, TypeError):
+        return None
+    return array
+
+
+def hero_stat_arrays(data):
+    # base and level 40 stats of a hero page as ivs arrays
+    if '4Base Stats' not in data or '5Max Level Stats' not in data:
+        return None
+    base_stats_table = data['4Base Stats'][0]
+    max_stats_table = data['5Max Level Stats'][0]
+    if base_stats_table is None or max_stats_table is None:
+        return None
+    arrays = [stats_table_to_ivs(base_stats_table), stats_table_to_ivs(max_stats_table)]
+    return None if None in arrays else arrays
+
+
 def get_learners(learners_table, skill_name):
     learners = {i+1:[] for i in range(5)}
     # l_data is one row in a 2D array representing the learners table
@@ -550,10 +760,10 @@ def get_learners(learners_table, skill_name):
     learners = '\n'.join(['%d★: %s' % (level, ', '.join(learners[level])) for level in learners if len(learners[level]) != 0])
     return learners
 
-def get_gauntlet_scores():
-        newurl = urllib.request.urlopen(GAUNTLET_URL).geturl()
-        toopen = urllib.request.Request(newurl, headers={'Accept-Language':'en-GB'})
-        html = BSoup(urllib.request.urlopen(toopen).read(), "lxml")
+async def get_gauntlet_scores():
+        # redirects are followed with the same headers
+        status, headers, body = await fetch(GAUNTLET_URL, headers={'Accept-Language':'en-GB'}, timeout_dur=None)
+        html = BSoup(body, "lxml")
         round = html.find_all('ul')[2]
         scores = [[m.find('div', attrs={'class':'tournaments-art-left'}), m.find('div', attrs={'class':'tournaments-art-right'})] for m in round.find_all('li')]
         scores = [[{'Name':s[0].p.text, 'Score':s[0].find_all('p')[-1].text, 'Status':'Same' if 'normal' in s[0]['class'][-1] else 'Weak'},
@@ -675,6 +885,8 @@ def standardize(d, k):
                     return None
             else:
                 return None
+            if not number.isdigit():
+                return None
             l[i] = (op, field, int(number))
         if '+' in l[i]:
             fields = None
@@ -0,0 +1,197 @@
+import re, html, urllib.parse
+from fehwiki_parse import feh_source, weapon_colour
+
+# builds get_data's data straight from a page's wikitext when every template on it is known here
+# anything generated (stats tables, refines, area grids) isn't in the wikitext, so pages using templates
+# without an extractor go to the rendered HTML instead. learner lists come from the skill index (known_learners)
+
+
+class UnknownMarkup(Exception):
+    pass
+
+
+def split_outside(text, separator):
+    # split on separator where it isn't inside a nested template or link
+    parts = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(text):
+        pair = text[i:i+2]
+        if pair in ['{{', '[[']:
+            depth += 1
+            i += 2
+        elif pair in ['}}', ']]'] and depth:
+            depth -= 1
+            i += 2
+        else:
+            if text[i] == separator and depth == 0:
+                parts.append(text[start:i])
+                start = i + 1
+            i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def parse_template(body):
+    parts = split_outside(body, '|')
+    name = ' '.join(parts[0].replace('_', ' ').split())
+    if name.startswith('Template:'):
+        name = name[len('Template:'):]
+    name = name[:1].upper() + name[1:]
+    params = {}
+    position = 0
+    for part in parts[1:]:
+        pieces = split_outside(part, '=')
+        if len(pieces) > 1:
+            params[pieces[0].strip().lower()] = '='.join(pieces[1:]).strip()
+        else:
+            position += 1
+            params[str(position)] = part.strip()
+    return name, params
+
+
+def parse_templates(wikitext):
+    # the top level templates of a page as (name, params), and the wikitext left around them
+    templates = []
+    rest = ''
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(wikitext):
+        pair = wikitext[i:i+2]
+        if pair == '{{':
+            if depth == 0:
+                rest += wikitext[start:i]
+                start = i + 2
+            depth += 1
+            i += 2
+        elif pair == '}}' and depth:
+            depth -= 1
+            i += 2
+            if depth == 0:
+                templates.append(parse_template(wikitext[start:i-2]))
+                start = i
+        else:
+            i += 1
+    if depth:
+        raise UnknownMarkup('unclosed template')
+    return templates, rest + wikitext[start:]
+
+
+def plain_text(value):
+    # what a parameter renders as, for values made of links and simple formatting only
+    if '{{' in value or '{|' in value:
+        raise UnknownMarkup(value)
+    value = re.sub(r'<!--.*?-->|<ref[^>]*/>|<ref[^>]*>.*?</ref>', '', value, flags=re.S)
+    value = re.sub(r'<br\s*/?>', '\n', value)
+    value = re.sub(r'\[\[(?:File|Image):[^\]]*\]\]', '', value)
+    value = re.sub(r'\[\[[^\]|]*\|([^\]]*)\]\]', r'\1', value)
+    value = re.sub(r'\[\[([^\]]*)\]\]', r'\1', value)
+    value = re.sub(r"'''?", '', value)
+    value = re.sub(r'<[^>]+>', '', value)
+    return html.unescape(value)
+
+
+def link_targets(value):
+    # the pages value links to, as the title attributes of the rendered links
+    targets = []
+    for target in re.findall(r'\[\[([^\]|]*)(?:\|[^\]]*)?\]\]', value):
+        target = ' '.join(target.replace('_', ' ').split())
+        if not target.startswith(('File:', 'Image:', 'Category:')):
+            targets.append(target[:1].upper() + target[1:])
+    return targets
+
+
+def inherit_restriction(value):
+    # parse_inherit_restriction on the row value renders to
+    targets = link_targets(value)
+    return plain_text(value).strip() + " " + (', '.join(targets).strip() if targets else '')
+
+
+def weapon_infobox(arg, categories, params, data, icon_wants, known_learners):
+    # the HTML path only treats it as a weapon when it isn't a hero page first
+    if 'Weapons' not in categories or 'Heroes' in categories or 'Enemy units' in categories:
+        raise UnknownMarkup('weapon infobox outside a weapon page')
+    data['Embed Info']['Colour'] = weapon_colour(categories)
+    data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
+    icon_wants.append((('Embed Info',), 'Icon', (arg, "Weapon_")))
+    for param, key, inline in [('might', '0Might', True), ('range', '1Range', True), ('cost', '2SP Cost', False)]:
+        value = plain_text(params.get(param, '')).strip()
+        if value:
+            data[key] = value, inline
+    exclusive = params.get('exclusive', '').strip().lower()
+    if exclusive:
+        if exclusive not in exclusive_values:
+            raise UnknownMarkup(exclusive)
+        data['3Exclusive?'] = exclusive_values[exclusive], True
+    if 'effect' in params:
+        data['5Description'] = plain_text(params['effect']).replace('  ', ' ').strip(), False
+    if arg not in known_learners:
+        raise UnknownMarkup('learners of ' + arg)
+    data['6Heroes with ' + arg] = known_learners[arg], False
+
+
+def skill_infobox(arg, categories, params, data, icon_wants, known_learners):
+    # specials and assists, the area grid of area of effect specials is generated so those stay on the HTML path
+    if any(i in categories for i in ['Heroes', 'Enemy units', 'Weapons', 'Passives', 'Area of Effect Specials']):
+        raise UnknownMarkup('skill infobox outside a special or assist page')
+    if 'Specials' in categories:
+        data['Embed Info']['Colour'] = 0xf499fe
+        first = '0Cooldown', 'cooldown'
+    elif 'Assists' in categories:
+        data['Embed Info']['Colour'] = 0x1fe2c3
+        first = '0Range', 'range'
+    else:
+        raise UnknownMarkup('skill infobox outside a special or assist page')
+    if 'Staff Assists' in categories:
+        icon_wants.append((('Embed Info',), 'Icon', (arg, "Weapon_")))
+    data['Embed Info']['URL'] = feh_source % (urllib.parse.quote(arg))
+    # empty cells read N/A in the HTML path
+    stats = {param: plain_text(params.get(param, '')).strip() or 'N/A' for param in [first[1], 'cost', 'effect', 'required']}
+    data[first[0]] = stats[first[1]], True
+    data['1SP Cost'] = stats['cost'], True
+    data['2Effect'] = stats['effect'], False
+    data['3Prequirement'] = stats['required'].replace('\n', ', '), False
+    data['4Inherit Restrictions'] = inherit_restriction(params.get('restriction', '')), True
+    name = plain_text(params.get('name', arg)).strip()
+    if name not in known_learners:
+        raise UnknownMarkup('learners of ' + name)
+    if known_learners[name]:
+        data['5Heroes with ' + arg] = known_learners[name], False
+
+
+exclusive_values = {'yes': 'Yes', '1': 'Yes', 'true': 'Yes', 'no': 'No', '0': 'No', 'false': 'No'}
+
+# template name to a function filling data from its parameters
+template_extractors = {
+    'Weapon Infobox': weapon_infobox,
+    'Special Infobox': skill_infobox,
+    'Assist Infobox': skill_infobox,
+}
+# templates that only affect layout and add nothing to data
+ignored_templates = ['Clear', '!', 'Tocright', 'TOC right', 'DISPLAYTITLE', 'DEFAULTSORT']
+
+
+def parse_data(arg, info, known_learners=None):
+    # same result as fehwiki_parse.parse_data, or None when the page needs the rendered HTML
+    if not known_learners:
+        return None
+    categories = [' '.join(k['*'].split('_')) for k in info['parse']['categories']]
+    try:
+        templates, rest = parse_templates(info['parse']['wikitext']['*'])
+        templates = [(name, params) for name, params in templates
+                     if name.split(':')[0] not in ignored_templates and not name.endswith('Navbox')]
+        if not templates or any(name not in template_extractors for name, params in templates):
+            return None
+        # prose, tables and redirects around the templates would show up in the HTML path's data too
+        rest = re.sub(r'<!--.*?-->|\[\[Category:[^\]]*\]\]|__[A-Z]+__', '', rest, flags=re.S)
+        if rest.strip():
+            return None
+        data = {'Embed Info': {'Title': arg, 'Icon': None}}
+        icon_wants = []
+        for name, params in templates:
+            template_extractors[name](arg, categories, params, data, icon_wants, known_learners)
+        return categories, data, [], icon_wants, None
+    except (UnknownMarkup, KeyError, ValueError):
+        return None
@@ -1,54 +1,136 @@
+import os, sys, json, time, asyncio, aiohttp
 from fehwiki_parse import *
 from feh_cache import *
+from http_client import run_sync, close, set_rate_limit
 from socket import timeout
 
+# pages fetched at the same time
+workers = int(os.environ.get('FEH_CRAWL_WORKERS', 8))
+# requests per second allowed against the wiki, shared by all workers
+requests_per_second = float(os.environ.get('FEH_CRAWL_RATE', 5))
+crawl_timeout = 30
+max_retries = 4
+retry_delay = 2
+checkpoint_filename = './full_update.checkpoint'
+# pages between checkpoints, the cache is flushed before each one so a resumed run never skips unsaved pages
+checkpoint_interval = 50
+report_interval = 25
 
-def update_category(cache, category):
-    cache.update()
-    page = get_page(
+
+def load_checkpoint():
+    if os.path.exists(checkpoint_filename):
+        with open(checkpoint_filename, 'r') as checkpoint:
+            done = set(json.load(checkpoint))
+        print("Resuming, %d pages already done." % len(done))
+        return done
+    return set()
+
+
+def save_checkpoint(done):
+    with open(checkpoint_filename + '.tmp', 'w') as checkpoint:
+        json.dump(sorted(done), checkpoint)
+    os.replace(checkpoint_filename + '.tmp', checkpoint_filename)
+
+
+async def get_members(category):
+    page = await get_page(
         'http://feheroes.gamepedia.com/api.php?action=query&list=categorymembers&cmtitle={}&cmlimit=500&cmtype=page&cmcontinue'.format(
             urllib.parse.quote('Category:'+category)))
     members = page['query']['categorymembers']
     while 'continue' in page:
-        page = get_page(
+        page = await get_page(
             'http://feheroes.gamepedia.com/api.php?action=query&list=categorymembers&cmtitle={}&cmlimit=500&cmtype=page&cmcontinue={}'.format(
                 urllib.parse.quote('Category:'+category), page['continue']['cmcontinue']))
         members.extend(page['query']['categorymembers'])
-    count = 0
-    try:
-        if members:
-            for member in members:
-                if not member.startswith('Category:') and \
-                        not member.startswith('Template:') and \
-                        not member.startswith('User talk:') and \
-                        ((member not in cache.data) or member in cache.replacement_list):
-                    print("Getting data for " + member)
-                    try:
-                        categories, data, other_pages = get_data(member, None)
-                        if member in cache.replacement_list:
-                            cache.replacement_list.remove(member)
-                        if any([c in categories for c in valid_categories]):
-                            if cache.add_data(member.lower(), data, categories, save=False):
-                                count += 1
-                        while cache_log:
-                            print(cache_log.pop())
-                    except IndexError as err:
-                        print(err)
-                    except TypeError as err:
-                        print(err)
-
-    except timeout:
-        print("Timed out")
+    return [member['title'] for member in members]
+
+
+async def get_data_with_retry(cache, member):
+    for attempt in range(max_retries + 1):
+        try:
+            return await get_data(member, crawl_timeout, cache)
+        except urllib.error.HTTPError as err:
+            # client errors won't go away by asking again
+            if err.code < 500 and err.code != 429 or attempt == max_retries:
+                raise
+            print("%s for %s, retrying" % (err, member))
+        except (timeout, aiohttp.ClientError) as err:
+            if attempt == max_retries:
+                raise
+            print("%s for %s, retrying" % (err, member))
+        await asyncio.sleep(retry_delay * 2 ** attempt)
+
+
+async def update_category(cache, category, done):
+    members = [member for member in await get_members(category)
+               if not member.startswith('Category:') and
+               not member.startswith('Template:') and
+               not member.startswith('User talk:') and
+               member not in done and
+               ((member not in cache.data) or member in cache.replacement_list)]
+    queue = asyncio.Queue()
+    for member in members:
+        queue.put_nowait(member)
+    progress = {'added': 0, 'fetched': 0, 'start': time.monotonic()}
+    loop = asyncio.get_event_loop()
 
+    def report():
+        elapsed = time.monotonic() - progress['start']
+        print("%s: %d/%d pages, %.2f pages/sec" % (category, progress['fetched'], len(members),
+                                                   progress['fetched'] / elapsed if elapsed else 0))
+
+    async def worker():
+        while True:
+            try:
+                member = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            print("Getting data for " + member)
+            try:
+                categories, data, other_pages = await get_data_with_retry(cache, member)
+            except (IndexError, TypeError, KeyError, AttributeError, timeout, urllib.error.HTTPError, aiohttp.ClientError) as err:
+                # left out of the checkpoint so the next run tries it again
+                print("%s: %s" % (member, err))
+                continue
+            cache.discard_replacement(member)
+            if categories and any([c in categories for c in valid_categories]):
+                if cache.add_data(member.lower(), data, categories, save=False):
+                    progress['added'] += 1
+            while cache_log:
+                print(cache_log.pop())
+            done.add(member)
+            progress['fetched'] += 1
+            if progress['fetched'] % report_interval == 0:
+                report()
+            if progress['fetched'] % checkpoint_interval == 0:
+                await loop.run_in_executor(None, cache.flush)
+                save_checkpoint(done)
+
+    try:
+        await asyncio.gather(*[worker() for i in range(workers)])
     finally:
-        print("Added " + str(count) + " " + category + " to cache")
-        if count:
-            cache.save()
+        report()
+        print("Added " + str(progress['added']) + " " + category + " to cache")
+        await loop.run_in_executor(None, cache.flush)
+        save_checkpoint(done)
 
-if __name__ == '__main__':
-    cache = FehCache()
+
+async def full_update(cache):
+    set_rate_limit('feheroes.gamepedia.com', requests_per_second)
+    await cache.update()
+    done = load_checkpoint()
     for c in valid_categories:
         if c == "Disambiguation pages":
             continue
-        update_category(cache, c)
+        await update_category(cache, c, done)
+    # everything made it into the cache so the next run starts fresh
+    os.remove(checkpoint_filename)
+    await close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        workers = int(sys.argv[1])
+    cache = FehCache()
+    run_sync(full_update(cache))
     print(cache.last_update)
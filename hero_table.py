@@ -0,0 +1,159 @@
+import os, argparse, itertools, functools
+import numpy as np
+from collections import namedtuple
+from caches import LRUCache
+from fehwiki_parse import standardize, shorten_hero_name
+
+# the heroes list as columns, so ?list filters with boolean masks and sorts with a single lexsort
+
+numeric_fields = ['HP', 'ATK', 'SPD', 'DEF', 'RES', 'BST']
+categorical_fields = ['Name', 'Colour', 'Weapon', 'Movement']
+# every table gets a new version, so results of an older roster are never served
+table_versions = itertools.count()
+# ?list queries whose results are kept, compiled queries are kept for as many argument lists
+query_cache_size = int(os.environ.get('FEH_LIST_QUERY_CACHE', 256))
+query_results = LRUCache(query_cache_size)
+
+# a ?list query in a normal form, queries that differ in the order of their filters share one
+# filters are (field, values) pairs and thresholds are (op, fields, number), both sorted
+ListQuery = namedtuple('ListQuery', ['filters', 'thresholds', 'sort_keys', 'highest_first'])
+
+list_arguments = argparse.ArgumentParser(description='Process arguments for heroes list.')
+list_arguments.add_argument('-f', nargs='*')
+list_arguments.add_argument('-s', nargs='*')
+list_arguments.add_argument('-r', action='store_const', const=False, default=True)
+list_arguments.add_argument('-p', type=int)
+usage_error = 'Unfortunately I had trouble figuring out what you wanted. Are you sure you typed the command correctly?\n' \
+              '```Usage: fehlist|list [-f filters] [-s fields_to_sort_by] [-r] [-p page]```'
+
+
+class ListQueryError(Exception):
+    """A ?list query that can't be run, the message is the reply."""
+
+
+@functools.lru_cache(maxsize=query_cache_size)
+def compile_list_query(args):
+    # args is the tuple of fehlist's arguments, gives the query and the page asked for (None without -p)
+    # raises ListQueryError with the reply for invalid ones
+    if '-p' in args:
+        if args[-1] == '-p' or not args[args.index('-p')+1].isdigit() or int(args[args.index('-p')+1]) < 1:
+            raise ListQueryError(usage_error)
+    options = tuple(arg for i, arg in enumerate(args) if arg != '-p' and (i == 0 or args[i-1] != '-p'))
+    if options:
+        if (len(options) > 1 and '-r' in options and '-f' not in options and '-s' not in options) or\
+            ('-r' not in options and '-f' not in options and '-s' not in options) or\
+            (options[0] not in ['-r', '-f', '-s']) or\
+            ('-r' in options and options[-1] != '-r' and options[options.index('-r')+1] not in ['-f', '-s']) or\
+            any('-' in arg and arg not in ['-r', '-f', '-s'] for arg in options):
+            raise ListQueryError(usage_error)
+    args = vars(list_arguments.parse_args(args=list(args)))
+    filters = {}
+    if args['f']:
+        filters = standardize(args, 'f')
+        if filters is None:
+            raise ListQueryError('Invalid filters or multiple filters for the same field were selected.')
+    sort_keys = []
+    if args['s']:
+        sort_keys = standardize(args, 's')
+        if sort_keys is None:
+            raise ListQueryError('Invalid fields to sort by were selected.')
+    thresholds = [(op, tuple(fields), number) for op, fields, number in filters.pop('Threshold', [])]
+    query = ListQuery(tuple(sorted((field, tuple(sorted(set(values)))) for field, values in filters.items())),
+                      tuple(sorted(set(thresholds), key=lambda t: (t[0].__name__, t[1], t[2]))),
+                      tuple(sort_keys), args['r'])
+    return query, args['p']
+
+
+class HeroTable(object):
+    """Column arrays of the heroes list. Stats are ints, text fields are codes numbered in
+    the same order as the text sorts in, so sorting by the code sorts by the text."""
+
+    def __init__(self, heroes):
+        self.version = next(table_versions)
+        self.rows = list(heroes.values()) if isinstance(heroes, dict) else list(heroes)
+        self.columns = {}
+        self.categories = {}
+        for field in numeric_fields:
+            self.columns[field] = np.array([row[field] for row in self.rows], dtype=np.int32)
+        for field in categorical_fields:
+            values = [row[field] for row in self.rows]
+            self.categories[field] = sorted(set(values))
+            codes = {value: i for i, value in enumerate(self.categories[field])}
+            self.columns[field] = np.array([codes[value] for value in values], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, key):
+        # a field, or the total of a tuple of stats
+        if isinstance(key, (tuple, list)):
+            return sum(self.columns[field] for field in key)
+        return self.columns[key]
+
+    def mask(self, filters):
+        # filters as standardize returns them
+        mask = np.ones(len(self.rows), dtype=bool)
+        for f in filters:
+            if f != 'Threshold':
+                codes = [self.categories[f].index(value) for value in filters[f] if value in self.categories[f]]
+                mask &= np.isin(self.columns[f], codes)
+            else:
+                for op, fields, number in filters[f]:
+                    mask &= op(self.column(fields), number)
+        return mask
+
+    def sort(self, indices, sort_keys, highest_first=True):
+        # stats go highest first and text alphabetically unless highest_first is False, ties are broken by name
+        keys = []
+        for key in list(sort_keys) + ['Name']:
+            column = self.column(key)[indices]
+            descending = not highest_first if key in categorical_fields else highest_first
+            keys.append(-column if descending else column)
+        # lexsort treats its last key as the primary one
+        return indices[np.lexsort(keys[::-1])]
+
+    def query(self, query):
+        # indices of the rows a ListQuery selects, in order
+        key = (query, self.version)
+        indices = query_results.get(key)
+        if indices is None:
+            filters = dict(query.filters)
+            if query.thresholds:
+                filters['Threshold'] = query.thresholds
+            indices = self.sort(np.flatnonzero(self.mask(filters)), query.sort_keys, query.highest_first)
+            query_results.put(key, indices)
+        return indices
+
+    def entries(self, indices, sort_keys):
+        # each hero's text in the list, with the values it was sorted by
+        names = [shorten_hero_name(self.rows[i]['Name']) for i in indices]
+        if not sort_keys or list(sort_keys) == ['Name']:
+            return names
+        shown = [[self.rows[i][key] for i in indices] if key in categorical_fields else self.column(key)[indices]
+                 for key in sort_keys if key != 'Name']
+        return ['%s (%s)' % (name, ','.join(str(values[j]) for values in shown)) for j, name in enumerate(names)]
+
+
+class ListPager(object):
+    """Splits list entries into pages of at most page_length characters. The running length of the
+    entries is summed once and each page ends where a binary search finds the limit."""
+
+    def __init__(self, entries, page_length=2000, separator=', '):
+        self.entries = entries
+        self.separator = separator
+        # ends[i] is the length of the first i+1 entries, each followed by a separator
+        ends = np.cumsum([len(entry) + len(separator) for entry in entries])
+        self.starts = [0]
+        while self.starts[-1] < len(entries):
+            start = self.starts[-1]
+            offset = ends[start-1] if start else 0
+            end = int(np.searchsorted(ends, offset + page_length + len(separator), side='right'))
+            self.starts.append(max(end, start + 1))
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def page(self, number):
+        # first and last+1 entry of a page counting from 1, and its text
+        start, end = self.starts[number-1], self.starts[number]
+        return start, end, self.separator.join(self.entries[start:end])
@@ -0,0 +1,176 @@
+import os, json, time, hashlib, asyncio, threading, urllib.error, urllib.parse, aiohttp
+from collections import Counter
+from socket import timeout
+
+user_agent = 'Mozilla/5.0'
+# most simultaneous connections each session keeps open
+connection_limit = int(os.environ.get('FEH_HTTP_CONNECTIONS', 20))
+
+# one pooled keep-alive session per event loop, aiohttp sessions can't be shared between loops
+sessions = {}
+# minimum seconds between requests to a host, only set by callers that crawl
+host_intervals = {}
+next_request_at = {}
+
+# responses fetched with a ttl are kept here, a file's mtime is when its response was last known to be current
+response_cache_dir = os.environ.get('FEH_HTTP_CACHE_DIR', './http_cache')
+# oldest responses are removed once there are more than this many
+response_cache_limit = int(os.environ.get('FEH_HTTP_CACHE_LIMIT', 5000))
+response_cache_stats = Counter()
+
+
+def get_session():
+    loop = asyncio.get_event_loop()
+    session = sessions.get(loop)
+    if session is None or session.closed:
+        # aiohttp asks for gzip and decompresses responses itself
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connection_limit),
+                                        headers={'User-Agent': user_agent})
+        sessions[loop] = session
+    return session
+
+
+def set_rate_limit(host, requests_per_second):
+    host_intervals[host] = 1 / requests_per_second if requests_per_second else 0
+
+
+async def throttle(url):
+    host = urllib.parse.urlsplit(url).netloc
+    interval = host_intervals.get(host)
+    if not interval:
+        return
+    # reserve the next free slot for this host before sleeping so concurrent callers queue up behind it
+    now = asyncio.get_event_loop().time()
+    slot = max(now, next_request_at.get(host, now))
+    next_request_at[host] = slot + interval
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+
+async def fetch(url, headers=None, timeout_dur=5):
+    """Fetch a url over the pooled session and return the status, headers and body.
+    Raises socket.timeout and urllib.error.HTTPError like urlopen did so existing handlers keep working."""
+    async def request():
+        response = await get_session().get(url, headers=headers)
+        body = await response.read()
+        return response.status, response.headers, body
+
+    await throttle(url)
+    try:
+        status, response_headers, body = await asyncio.wait_for(request(), timeout_dur)
+    except asyncio.TimeoutError:
+        raise timeout('timed out fetching %s' % url)
+    if status >= 400:
+        raise urllib.error.HTTPError(url, status, 'HTTP Error %d' % status, response_headers, None)
+    return status, response_headers, body
+
+
+def cached_path(url):
+    return os.path.join(response_cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+
+def read_cached(url):
+    # the first line holds the validators the server sent, the rest is the body, also gives the file's mtime
+    try:
+        with open(cached_path(url), 'rb') as cached:
+            validators = json.loads(cached.readline().decode('utf-8'))
+            return validators, cached.read(), os.fstat(cached.fileno()).st_mtime
+    except (OSError, ValueError):
+        return None, None, None
+
+
+def write_cached(url, validators, body):
+    os.makedirs(response_cache_dir, exist_ok=True)
+    path = cached_path(url)
+    # writes run on executor threads, each gets its own temporary file
+    temporary = '%s.%d.tmp' % (path, threading.get_ident())
+    with open(temporary, 'wb') as cached:
+        cached.write(json.dumps(validators).encode('utf-8') + b'\n' + body)
+    os.replace(temporary, path)
+    response_cache_stats['stored'] += 1
+    if response_cache_stats['stored'] % 100 == 0:
+        prune_cached()
+
+
+def touch_cached(url, validators, body):
+    # a 304 means the response is current again, write it back if a prune removed it meanwhile
+    try:
+        os.utime(cached_path(url))
+    except OSError:
+        write_cached(url, validators, body)
+
+
+def modified_time(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def prune_cached():
+    paths = [os.path.join(response_cache_dir, name) for name in os.listdir(response_cache_dir) if not name.endswith('.tmp')]
+    if len(paths) > response_cache_limit:
+        for path in sorted(paths, key=modified_time)[:len(paths) - response_cache_limit]:
+            forget_path(path)
+
+
+def forget_path(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def forget(url):
+    # drop a cached response, used when the page is known to have changed
+    forget_path(cached_path(url))
+
+
+async def fetch_cached(url, ttl, headers=None, timeout_dur=5):
+    """Fetch a url through the on-disk response cache and return the body.
+    Responses younger than ttl seconds are served without a request, older ones are revalidated
+    with If-None-Match/If-Modified-Since so an unchanged response only costs a 304.
+    The cache files are read and written in the default executor so the event loop never waits on the disk."""
+    loop = asyncio.get_event_loop()
+    validators, body, modified = await loop.run_in_executor(None, read_cached, url)
+    if validators is not None and time.time() - modified < ttl:
+        response_cache_stats['fresh'] += 1
+        return body
+    request_headers = dict(headers or {})
+    if validators is not None:
+        if validators.get('etag'):
+            request_headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            request_headers['If-Modified-Since'] = validators['last_modified']
+    status, response_headers, new_body = await fetch(url, request_headers, timeout_dur)
+    if status == 304 and validators is not None:
+        response_cache_stats['revalidated'] += 1
+        await loop.run_in_executor(None, touch_cached, url, validators, body)
+        return body
+    response_cache_stats['fetched'] += 1
+    await loop.run_in_executor(None, write_cached, url, {'etag': response_headers.get('ETag'),
+                                                         'last_modified': response_headers.get('Last-Modified')}, new_body)
+    return new_body
+
+
+async def fetch_json(url, headers=None, timeout_dur=5, ttl=None):
+    if ttl:
+        body = await fetch_cached(url, ttl, headers, timeout_dur)
+    else:
+        status, response_headers, body = await fetch(url, headers, timeout_dur)
+    return json.loads(body.decode('utf-8'))
+
+
+async def close():
+    session = sessions.pop(asyncio.get_event_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def run_sync(coroutine):
+    """Run a coroutine to completion from synchronous code such as full_update.
+    Inside the bot the coroutine should be awaited instead."""
+    loop = asyncio.get_event_loop()
+    if loop.is_running():
+        raise RuntimeError('run_sync cannot be called from inside a running event loop, await instead')
+    return loop.run_until_complete(coroutine)
@@ -1,4 +1,4 @@
-import discord, os, re, random
+import discord, os, re, random, signal
 from discord.ext import commands
 
 import utilities, fehwiki_parse
@@ -63,6 +63,12 @@ token = os.environ.get('TOKEN', default=None)
 if token is None:
     token = open('./token').read().replace('\n', '')
 
+def shutdown(signum, frame):
+    # let bot.run log out cleanly, the cache flushes itself on the way out
+    raise KeyboardInterrupt
+
+signal.signal(signal.SIGTERM, shutdown)
+
 utilities.setup(bot)
 dl.setup(bot)
 
@@ -0,0 +1,51 @@
+from collections import defaultdict, Counter
+
+
+class NgramIndex(object):
+    """Inverted index from character n-grams to the keys containing them.
+    Shortlists the keys sharing the most n-grams with a query without looking at every key."""
+
+    def __init__(self, keys=(), n=3):
+        self.n = n
+        self.postings = defaultdict(set)
+        self.key_grams = {}
+        for key in keys:
+            self.add(key)
+
+    def ngrams(self, text):
+        # pad so short keys and the start and end of words still get n-grams
+        padded = '$' * (self.n - 1) + text + '$' * (self.n - 1)
+        return {padded[i:i+self.n] for i in range(len(padded) - self.n + 1)}
+
+    def add(self, key):
+        if key in self.key_grams:
+            return
+        grams = self.ngrams(key)
+        self.key_grams[key] = grams
+        for gram in grams:
+            self.postings[gram].add(key)
+
+    def discard(self, key):
+        grams = self.key_grams.pop(key, None)
+        if grams is None:
+            return
+        for gram in grams:
+            self.postings[gram].discard(key)
+            if not self.postings[gram]:
+                del self.postings[gram]
+
+    def __contains__(self, key):
+        return key in self.key_grams
+
+    def __len__(self):
+        return len(self.key_grams)
+
+    def shortlist(self, query, limit=50):
+        # rank by dice coefficient of the n-gram sets, which tracks SequenceMatcher.ratio closely
+        query_grams = self.ngrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self.postings.get(gram, ()))
+        scores = [(2 * count / (len(query_grams) + len(self.key_grams[key])), key) for key, count in shared.items()]
+        scores.sort(key=lambda s: s[0], reverse=True)
+        return [key for score, key in scores[:limit]]
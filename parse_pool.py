@@ -0,0 +1,30 @@
+import os, asyncio, functools
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# processes that parse pages off the event loop, 0 parses in the bot's own process
+parse_workers = int(os.environ.get('FEH_PARSE_WORKERS', 2))
+
+pool = None
+
+
+def get_pool():
+    global pool
+    if pool is None:
+        pool = ProcessPoolExecutor(parse_workers)
+    return pool
+
+
+async def parse(function, *args):
+    """Run a parsing function in the worker pool and await its result.
+    function and its arguments have to be picklable, which means a module level function and plain data.
+    Falls back to parsing in-process when there are no workers or the pool can't be used."""
+    global pool
+    if parse_workers > 0:
+        try:
+            return await asyncio.get_event_loop().run_in_executor(get_pool(), functools.partial(function, *args))
+        except (BrokenProcessPool, OSError) as ex:
+            # a worker died or couldn't be started, a fresh pool is tried next time
+            print(ex)
+            pool = None
+    return function(*args)
@@ -0,0 +1,108 @@
+import re
+from collections import defaultdict, Counter
+from fehwiki_parse import shorten_hero_name
+
+
+def learnable_skills(text):
+    # (skill, page, rarity, section) from a Learnable Skills field, for heroes cached before pages kept their Skills
+    # the field only has the rarity of the last skill on each line
+    learnset = []
+    for line in text.split('\n'):
+        match = re.match(r'\*\*(.+?):\*\* (.*)$', line)
+        if not match:
+            continue
+        section, skills = match.groups()
+        skills = skills.split(', ')
+        rarity = None
+        last = re.match(r'(.*) \((\d)★\)$', skills[-1])
+        if last:
+            skills[-1], rarity = last.group(1), int(last.group(2))
+        learnset.extend((skill, None, None, section) for skill in skills[:-1])
+        learnset.append((skills[-1], None, rarity, section))
+    return learnset
+
+
+class SkillIndex(object):
+    """Index between cached heroes and the skills they learn, both ways, with the rarity each one is learned at.
+    Heroes indexed from the Learnable Skills text are partial, most of their rarities aren't known."""
+
+    def __init__(self):
+        # hero to {skill: (rarity, page, section)}
+        self.hero_skills = {}
+        # skill to {hero: rarity}
+        self.skill_heroes = defaultdict(dict)
+        # page to {skill: heroes learning it}
+        self.page_skills = defaultdict(Counter)
+        self.sections = {}
+        self.names = {}
+        self.partial = set()
+
+    def add(self, hero, data):
+        self.discard(hero)
+        if 'Skills' in data:
+            learnset = data['Skills']
+        elif '6Learnable Skills' in data:
+            learnset = learnable_skills(data['6Learnable Skills'][0])
+            self.partial.add(hero)
+        else:
+            return
+        self.hero_skills[hero] = {}
+        for skill, page, rarity, section in learnset:
+            if skill in self.hero_skills[hero]:
+                continue
+            self.hero_skills[hero][skill] = (rarity, page, section)
+            self.skill_heroes[skill][hero] = rarity
+            if page is not None:
+                self.page_skills[page][skill] += 1
+            self.sections[skill] = section
+            self.names[skill.lower()] = skill
+
+    def discard(self, hero):
+        self.partial.discard(hero)
+        for skill, (rarity, page, section) in self.hero_skills.pop(hero, {}).items():
+            self.skill_heroes[skill].pop(hero, None)
+            if not self.skill_heroes[skill]:
+                del self.skill_heroes[skill]
+                del self.sections[skill]
+                self.names.pop(skill.lower(), None)
+            if page is not None:
+                self.page_skills[page][skill] -= 1
+                if self.page_skills[page][skill] <= 0:
+                    del self.page_skills[page][skill]
+                    if not self.page_skills[page]:
+                        del self.page_skills[page]
+
+    def find(self, name):
+        # the skill as the wiki writes it, None if no cached hero learns it
+        if name in self.skill_heroes:
+            return name
+        return self.names.get(name.lower())
+
+    def learners(self, skill, rarity=None):
+        # hero to the rarity they learn skill at, only those learning it at rarity if one is given
+        heroes = self.skill_heroes.get(skill, {})
+        if rarity is None:
+            return dict(heroes)
+        return {hero: learned for hero, learned in heroes.items() if learned == rarity}
+
+    def skills(self, hero):
+        return self.hero_skills.get(hero, {})
+
+    def covers(self, heroes):
+        # whether every one of heroes is indexed with all their rarities
+        return bool(heroes) and all(hero in self.hero_skills and hero not in self.partial for hero in heroes)
+
+    def learners_field(self, skill):
+        # the Heroes with field of a skill page, as get_learners makes it from the wiki's table
+        learners = self.learners(skill)
+        if self.sections.get(skill) == 'Weapons':
+            return ', '.join(shorten_hero_name(hero) for hero in sorted(learners))
+        levels = {level: sorted(hero for hero in learners if learners[hero] == level) for level in range(1, 6)}
+        return '\n'.join(['%d★: %s' % (level, ', '.join(map(shorten_hero_name, levels[level])))
+                          for level in levels if levels[level]])
+
+    def page_learners(self, page, roster):
+        # skill name to its Heroes with field for the skills on page, None unless all of roster is indexed
+        if page not in self.page_skills or not self.covers(roster):
+            return None
+        return {skill: self.learners_field(skill) for skill in self.page_skills[page]}
@@ -0,0 +1,77 @@
+import os, json, unittest
+import fehwiki_parse, fehwiki_lxml, fehwiki_wikitext
+from bench_parsers import fixtures_dir, load_fixtures, run
+
+# the lxml parser has to give exactly what the BeautifulSoup one does, errors included
+
+
+class ParserParityTest(unittest.TestCase):
+    def setUp(self):
+        self.fixtures = load_fixtures(fixtures_dir)
+
+    def heroes_list(self):
+        with open(os.path.join(fixtures_dir, 'heroes_list.json')) as fixture:
+            return json.load(fixture)
+
+    def test_pages(self):
+        self.assertTrue(self.fixtures)
+        for (title, info), expected, actual in zip(self.fixtures, run(fehwiki_parse.parse_data, self.fixtures),
+                                                   run(fehwiki_lxml.parse_data, self.fixtures)):
+            self.assertEqual(expected, actual, title)
+
+    def test_lxml_extracts_its_pages(self):
+        # the fallback to bs4 would hide a broken extractor, so the pages it claims must not need it
+        for title, info in self.fixtures:
+            if any(' '.join(c['*'].split('_')) in fehwiki_lxml.extracted_categories for c in info['parse']['categories']):
+                self.assertEqual(fehwiki_parse.parse_data(title, info), fehwiki_lxml.extract_data(title, info), title)
+
+    def test_heroes_list(self):
+        info = self.heroes_list()
+        expected = fehwiki_parse.parse_heroes_list(info)
+        self.assertTrue(expected)
+        self.assertEqual(expected, fehwiki_lxml.parse_heroes_list(info))
+
+    def test_heroes_list_short_row(self):
+        info = self.heroes_list()
+        info['parse']['text']['*'] = info['parse']['text']['*'].replace('<td>-</td>' * 6, '<td>-</td>' * 3)
+        self.assertRaises(IndexError, fehwiki_parse.parse_heroes_list, info)
+        self.assertRaises(IndexError, fehwiki_lxml.parse_heroes_list, info)
+
+
+# a page built from wikitext has to match the HTML parse of the same page, learners coming from the skill index
+
+
+class WikitextParityTest(unittest.TestCase):
+    def load(self, name):
+        with open(os.path.join(fixtures_dir, name)) as fixture:
+            return json.load(fixture)
+
+    def pairs(self):
+        names = [name for name in sorted(os.listdir(fixtures_dir)) if name.endswith('_wikitext.json')]
+        return [(self.load(name), self.load(name.replace('_wikitext', ''))) for name in names]
+
+    def test_pages(self):
+        self.assertTrue(self.pairs())
+        for wikitext, page in self.pairs():
+            title = page['parse']['title']
+            for known_learners in [{title: '4★: Hero0:SoTH\n5★: Hero1:SoTH'}, {title: ''}]:
+                self.assertEqual(fehwiki_parse.parse_data(title, page, known_learners),
+                                 fehwiki_wikitext.parse_data(title, wikitext, known_learners), title)
+
+    def test_falls_back(self):
+        wikitext, page = self.pairs()[0]
+        title = page['parse']['title']
+        text = wikitext['parse']['wikitext']['*']
+        known_learners = {title: '5★: Hero0:SoTH'}
+        self.assertIsNotNone(fehwiki_wikitext.parse_data(title, wikitext, known_learners))
+        # learners the skill index doesn't have
+        self.assertIsNone(fehwiki_wikitext.parse_data(title, wikitext, None))
+        self.assertIsNone(fehwiki_wikitext.parse_data(title, wikitext, {'Other': ''}))
+        for changed in [text + '{{Refine Table}}', text + 'Some prose.', text.replace('}}', '', 1),
+                        text.replace('|effect=', '|effect={{Tt|x}}')]:
+            wikitext['parse']['wikitext']['*'] = changed
+            self.assertIsNone(fehwiki_wikitext.parse_data(title, wikitext, known_learners), changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import re, math
+import unidecode
+from collections import defaultdict, Counter
+
+token_pattern = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    return token_pattern.findall(unidecode.unidecode(text).lower())
+
+
+def page_documents(title, data):
+    # skill name to the effect text of a cached page, one per tier on passive pages
+    # weapons contribute their description and the effects of their refines
+    documents = {}
+    if 'Data' in data:
+        for tier in data['Data']:
+            if '2Effect' in tier:
+                documents[tier['Embed Info']['Title']] = tier['2Effect'][0]
+    else:
+        texts = [data[key][0] for key in ['2Effect', '5Description'] if key in data]
+        texts += ['%s: %s' % (refine['Type'], refine['Effect']) for refine in data.get('Refine', [])
+                  if refine['Effect'] != 'No Effect']
+        if texts:
+            documents[title] = '\n'.join(texts)
+    return documents
+
+
+class TextIndex(object):
+    """Inverted index from words to the skills whose effects contain them, ranked with BM25.
+    Documents are added and dropped a page at a time so it follows the cache as pages change."""
+
+    def __init__(self, pages=None, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        # word to {(title, skill): count}
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.texts = {}
+        self.page_skills = {}
+        self.total_length = 0
+        if pages is not None:
+            for title, data in pages.items():
+                self.add(title, data)
+
+    def add(self, title, data):
+        self.discard(title)
+        documents = page_documents(title, data)
+        if not documents:
+            return
+        self.page_skills[title] = list(documents)
+        for skill, text in documents.items():
+            document = (title, skill)
+            words = tokenize(text)
+            for word, count in Counter(words).items():
+                self.postings[word][document] = count
+            self.lengths[document] = len(words)
+            self.texts[document] = text
+            self.total_length += len(words)
+
+    def discard(self, title):
+        for skill in self.page_skills.pop(title, ()):
+            document = (title, skill)
+            text = self.texts.pop(document)
+            for word in set(tokenize(text)):
+                self.postings[word].pop(document, None)
+                if not self.postings[word]:
+                    del self.postings[word]
+            self.total_length -= self.lengths.pop(document)
+
+    def search(self, query, titles=None):
+        # (score, title, skill, text) of the skills containing every word of query, best first
+        # titles limits the results to those pages
+        words = set(tokenize(query))
+        if not words or any(word not in self.postings for word in words):
+            return []
+        words = sorted(words, key=lambda word: len(self.postings[word]))
+        matches = set(self.postings[words[0]])
+        for word in words[1:]:
+            matches.intersection_update(self.postings[word])
+        if titles is not None:
+            matches = {document for document in matches if document[0] in titles}
+        average_length = self.total_length / len(self.lengths)
+        results = []
+        for document in matches:
+            score = 0
+            for word in words:
+                count = self.postings[word][document]
+                idf = math.log(1 + (len(self.lengths) - len(self.postings[word]) + 0.5) / (len(self.postings[word]) + 0.5))
+                score += idf * count * (self.k1 + 1) / \
+                    (count + self.k1 * (1 - self.b + self.b * self.lengths[document] / average_length))
+            results.append((score, document[0], document[1], self.texts[document]))
+        results.sort(key=lambda result: (-result[0], result[2]))
+        return results
+
+    def __len__(self):
+        return len(self.lengths)
@@ -1,11 +1,15 @@
-import discord, random, argparse, os.path, itertools, traceback
+import discord, random, os.path, traceback, asyncio, heapq, time
 import numpy as np
 from socket import timeout
 from discord.ext import commands as bot
 from fehwiki_parse import *
+from feh_stats import stats, merge_bonuses, summoner_bonuses, neutral_merge_bonus
+from http_client import fetch
 from difflib import SequenceMatcher
 
 import feh_cache
+from hero_table import compile_list_query, ListQueryError, ListPager
+from caches import TTLCache
 
 
 class MagikarpJump:
@@ -67,13 +71,19 @@ class ASCIIMessage:
 
 
 # these are constant so declare up here
-stats = ['HP', 'ATK', 'SPD', 'DEF', 'RES']
-merge_bonuses = [np.zeros(5), np.array([1,1,0,0,0]), np.array([1,1,1,1,0]), np.array([2,1,1,1,1]), np.array([2,2,2,1,1]), np.array([2,2,2,2,2]),
-                 np.array([3,3,2,2,2]), np.array([3,3,3,3,2]), np.array([4,3,3,3,3]), np.array([4,4,4,3,3]), np.array([4,4,4,4,4])]
-summoner_bonuses = {None:np.zeros(5), 'c':np.array([3,0,0,0,2]), 'b':np.array([4,0,0,2,2]), 'a':np.array([4,0,2,2,2]), 's':np.array([5,2,2,2,2])}
 separators = ['v', 'vs', '-v', '&', '|']
 diff_limit = 6
 compare_limit = 40
+# seconds between recentchanges polls
+recent_changes_interval = int(os.environ.get('FEH_POLL_INTERVAL', 60))
+# seconds before the heroes list is fetched again when its page hasn't been edited
+heroes_list_ttl = int(os.environ.get('FEH_LIST_TTL', 6 * 3600))
+# how long a user's last ?list stays paged, so -p can get the rest of it
+list_cursor_ttl = int(os.environ.get('FEH_LIST_CURSOR_TTL', 900))
+list_cursor_count = 500
+# skills shown by ?search and how much of each effect
+search_limit = 10
+search_text_length = 150
 
 def find_arg(args, param_list, return_list, param_type, remove=True):
     """Finds arguments that exist in param_list and return the corresponding value from return_list."""
@@ -138,6 +148,37 @@ class FireEmblemHeroes:
     def __init__(self, bot):
         self.bot = bot
         self.cache = feh_cache.FehCache()
+        self.list_refreshed = None
+        # user to (query, table version, results, pager) of their last ?list
+        self.list_cursors = TTLCache(list_cursor_count, list_cursor_ttl)
+        self.bot.loop.create_task(self.poll_recent_changes())
+
+    async def poll_recent_changes(self):
+        # commands only look at the replacement list and the cached heroes list, this keeps them current
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed:
+            changes = await self.cache.update()
+            if any(change['title'] == heroes_list_page for change in changes) or self.list_refreshed is None or\
+                    time.monotonic() - self.list_refreshed >= heroes_list_ttl:
+                self.bot.loop.create_task(self.refresh_heroes_list())
+            await asyncio.sleep(recent_changes_interval)
+
+    async def refresh_heroes_list(self):
+        # set_list only records and saves when a hero's row changed
+        # the table is built from other pages so recentchanges rarely lists it, skip the day long response cache
+        try:
+            forget_page(heroes_list_page)
+            heroes = await get_heroes_list()
+            if heroes:
+                self.cache.set_list(heroes)
+            self.list_refreshed = time.monotonic()
+        except Exception as ex:
+            print(ex)
+
+    def similar_candidates(self, arg):
+        # only the aliases sharing the most trigrams get the exact (and slow) ratio
+        candidates = self.cache.alias_index.shortlist(arg.lower().replace(' ', ''))
+        return candidates if candidates else self.cache.aliases
 
     def find_similar(self, arg):
         return '\n'.join(
@@ -151,14 +192,20 @@ class FireEmblemHeroes:
               if self.cache.aliases[p[0]] in self.cache.categories else ('Old Page: ' + self.cache.aliases[p[0]]))
               + ')_'
              for p in
-             sorted([[page, SequenceMatcher(None, arg.lower().replace(' ', ''), page).ratio()]
-                     for page in self.cache.aliases], key=lambda x:x[1], reverse=True)[:3]
+             heapq.nlargest(3, [[page, SequenceMatcher(None, arg.lower().replace(' ', ''), page).ratio()]
+                                for page in self.similar_candidates(arg)], key=lambda x:x[1])
              ]
         )
 
-    def find_data(self, arg, original_arg, ctx=None, ignore_cache=False):
+    async def find_data(self, arg, original_arg, ctx=None, ignore_cache=False):
         try:
-            arg = find_name(arg, self.cache, ctx=ctx)
+            # names the wiki already didn't know skip straight to the suggestions
+            miss_key = (normalize_name(arg), normalize_name(original_arg))
+            similar = self.cache.misses.get(miss_key)
+            if similar is None:
+                arg = await find_name(arg, self.cache, ctx=ctx)
+            else:
+                arg = INVALID_HERO
             if arg == INVALID_HERO:
                 if ctx:
                     if original_arg.lower() in ['son', 'my son']:
@@ -167,9 +214,14 @@ class FireEmblemHeroes:
                     elif original_arg.lower() in ['waifu', 'my waifu']:
                         return False, False,\
                             "I was not aware you had one. If you want me to associate you with one, use the setwaifu command."
+                if similar is None:
+                    similar = self.find_similar(original_arg)
+                    # whether someone has a son or waifu changes without touching aliases
+                    if original_arg.lower() not in ['son', 'my son', 'waifu', 'my waifu']:
+                        self.cache.misses.put(miss_key, similar)
                 return False, False,\
                        "I'm afraid I couldn't find information on %s. Could you have meant:\n%s"\
-                       % (original_arg.replace('*','\*').replace('_','\_'), self.find_similar(original_arg))
+                       % (original_arg.replace('*','\*').replace('_','\_'), similar)
 
             data = None
             categories = None
@@ -177,7 +229,9 @@ class FireEmblemHeroes:
                 categories = self.cache.categories[arg]
                 data = self.cache.data[arg]
             if data is None or arg in self.cache.replacement_list:
-                new_categories, new_data, other_pages = get_data(arg)
+                if ignore_cache:
+                    forget_page(arg)
+                new_categories, new_data, other_pages = await get_data(arg, cache=self.cache)
                 if new_data is None:
                     if 'Persons' not in new_categories:
                         return False, False,\
@@ -188,10 +242,9 @@ class FireEmblemHeroes:
                 else:
                     categories = new_categories
                     data = new_data
-                    if arg in self.cache.replacement_list:
-                        self.cache.replacement_list.remove(arg)
+                    self.cache.discard_replacement(arg)
                     if data['Embed Info']['Title'] not in self.cache.data and other_pages:
-                        self.cache.replacement_list.update(set(other_pages))
+                        self.cache.add_replacements(set(other_pages))
             return arg, categories, data
         except timeout:
             print('Timed out')
@@ -211,7 +264,7 @@ class FireEmblemHeroes:
                 return arg, categories, data
             return False, False, 'It appears the data I have is incomplete. Please try again later.'
 
-    def get_unit_stats(self, args, default_rarity=None, ctx=None):
+    async def get_unit_stats(self, args, default_rarity=None, ctx=None):
         # convert to lower case
         args = list(map(lambda x: x.lower(), args))
 
@@ -273,7 +326,7 @@ class FireEmblemHeroes:
 
         # get the hero information
         args = ' '.join(args)
-        unit, categories, data = self.find_data(args, args, ctx)
+        unit, categories, data = await self.find_data(args, args, ctx)
         if not unit:
             return False, data
         should_save = self.cache.add_data(args, data, categories, save=False)
@@ -288,30 +341,36 @@ class FireEmblemHeroes:
             return should_save, 'This hero does not appear to have stats.'
         if boon is None and bane is None and rarity is None and merge is None and support is None and modifiers is None:
             return should_save, (data['Embed Info'], base_stats_table, max_stats_table)
-        base_stats = table_to_array(base_stats_table, boon, bane, rarity)
-        max_stats = table_to_array(max_stats_table, boon, bane, rarity)
-        # check if empty
-        if not any([any(r) for r in base_stats]):
-            return should_save, 'This hero does not appear to be available at the specified rarity.'
-        # calculate merge bonuses
-        if merge is not None:
-            for i in range(5):
-                if any(base_stats[i]):
-                    ordered_stats = (-base_stats[i]).argsort()
-                    bonuses = np.zeros(5, dtype=np.int32)
-                    bonuses[ordered_stats] = merge_bonuses[merge]
-                    if merge != 0:
-                        if bane is None and boon is None:
-                            bonuses[ordered_stats] += [1,1,1,0,0]
-                    max_stats[i] += bonuses
-                    base_stats[i] += bonuses
+        found = self.cache.stat_engine.lookup(data['Embed Info']['Title'], boon, bane, merge, support, rarity)
+        if found is not None:
+            base_stats, max_stats = found
+            if not any([any(r) for r in base_stats]):
+                return should_save, 'This hero does not appear to be available at the specified rarity.'
+        else:
+            base_stats = table_to_array(base_stats_table, boon, bane, rarity)
+            max_stats = table_to_array(max_stats_table, boon, bane, rarity)
+            # check if empty
+            if not any([any(r) for r in base_stats]):
+                return should_save, 'This hero does not appear to be available at the specified rarity.'
+            # calculate merge bonuses
+            if merge is not None:
+                for i in range(5):
+                    if any(base_stats[i]):
+                        ordered_stats = (-base_stats[i]).argsort()
+                        bonuses = np.zeros(5, dtype=np.int32)
+                        bonuses[ordered_stats] = merge_bonuses[merge]
+                        if merge != 0:
+                            if bane is None and boon is None:
+                                bonuses[ordered_stats] += neutral_merge_bonus
+                        max_stats[i] += bonuses
+                        base_stats[i] += bonuses
 
-        # summoner bonuses
-        if support is not None:
-            for i in range(5):
-                if any(base_stats[i]):
-                    base_stats[i] += summoner_bonuses[support]
-                    max_stats[i] += summoner_bonuses[support]
+            # summoner bonuses
+            if support is not None:
+                for i in range(5):
+                    if any(base_stats[i]):
+                        base_stats[i] += summoner_bonuses[support]
+                        max_stats[i] += summoner_bonuses[support]
         # add flat modifiers
         if modifiers is not None:
             for i in range(5):
@@ -324,7 +383,7 @@ class FireEmblemHeroes:
     async def fehgauntlet(self):
         """I will tell you the current Voting Gauntlet score."""
         try:
-            scores = get_gauntlet_scores()
+            scores = await get_gauntlet_scores()
         except urllib.error.HTTPError as err:
             if err.code >= 500:
                 await self.bot.say("Unfortunately, it seems like I cannot access my sources at the moment. Please try again later.")
@@ -342,7 +401,7 @@ class FireEmblemHeroes:
     @bot.command(pass_context=True)
     async def setson(self, ctx, *, son):
         """Set your son so you can find their information easily with `?feh son`! Unset your son with `?setson none`."""
-        true_son = None if son.lower() == 'none' else find_name(son, self.cache)
+        true_son = None if son.lower() == 'none' else await find_name(son, self.cache)
         if true_son == INVALID_HERO:
             true_son = son
         self.cache.set_fam('son', str(ctx.message.author.id), true_son)
@@ -354,7 +413,7 @@ class FireEmblemHeroes:
     @bot.command(pass_context=True)
     async def setwaifu(self, ctx, *, waifu):
         """Set your waifu so you can find their information easily with `?feh waifu`! Unset your waifu with `?setwaifu none`."""
-        true_waifu = None if waifu.lower() == 'none' else find_name(waifu, self.cache)
+        true_waifu = None if waifu.lower() == 'none' else await find_name(waifu, self.cache)
         if true_waifu == INVALID_HERO:
             true_waifu = waifu
         self.cache.set_fam('waifu', str(ctx.message.author.id), true_waifu)
@@ -436,7 +495,7 @@ class FireEmblemHeroes:
                 await self.bot.say("Cleared!")
                 return
             elif arg.startswith('-reload'):
-                self.cache.load()
+                self.cache.reload()
                 await self.bot.say("Reloaded!\n" + self.cache.last_update)
                 return
             elif arg.startswith('-currreplace'):
@@ -450,22 +509,25 @@ class FireEmblemHeroes:
                     await self.bot.say(message)
                 return
             elif arg.startswith('-clearreplace'):
-                self.cache.replacement_list.clear()
-                self.cache.save()
+                self.cache.clear_replacements()
                 await self.bot.say("Cleared replacement list!")
                 return
             elif arg.startswith('-delreplace'):
                 for r in self.cache.replacement_list:
                     self.cache.delete_data(r)
-                self.cache.replacement_list.clear()
-                self.cache.save()
+                self.cache.clear_replacements()
                 await self.bot.say("Cleared replacement list!")
                 return
             elif arg.startswith('-clearherolist'):
-                self.cache.list = []
-                self.cache.save()
+                self.cache.clear_list()
                 await self.bot.say("Cleared hero list!")
                 return
+            elif arg.startswith('-resolverstats'):
+                total = sum(resolution_stats.values())
+                await self.bot.say('\n'.join(['%s: %d (%.1f%%)' % (source, resolution_stats[source],
+                                                                   100 * resolution_stats[source] / total if total else 0)
+                                              for source in ['alias', 'local', 'remote']]))
+                return
 
         python_format = ctx.message.author.id in self.cache.python_preference
         if '-lukas' in arg:
@@ -477,13 +539,12 @@ class FireEmblemHeroes:
             l_i = arg.find('-python')
             arg = (arg[:l_i] + arg[l_i + 7:]).replace('  ', ' ')
 
-        self.cache.update()
         original_arg = arg
         passive_level = -1
         if arg[-1] in ['1','2','3', '4', '5']:
             passive_level = int(arg[-1]) - 1
             arg = arg[:-1].strip()
-        arg, categories, original_data = self.find_data(arg, original_arg, ctx, ignore_cache)
+        arg, categories, original_data = await self.find_data(arg, original_arg, ctx, ignore_cache)
         if not arg:
             if original_data.startswith("I'm"):
                 if any([(' ' + separator + ' ') in original_arg for separator in separators]) or\
@@ -587,8 +648,6 @@ class FireEmblemHeroes:
     @bot.command(pass_context=True, aliases=['refine', 'Refine', 'Fehrefine', 'FEHRefine'])
     async def fehrefine(self, ctx, *, args):
         """View the refinery options for a weapon."""
-        self.cache.update()
-
         python_format = ctx.message.author.id in self.cache.python_preference
         if '-lukas' in args:
             python_format = False
@@ -600,7 +659,7 @@ class FireEmblemHeroes:
             args = (args[:l_i] + args[l_i + 7:]).replace('  ', ' ')
 
         while (True):
-            weapon, categories, data = self.find_data(args, args)
+            weapon, categories, data = await self.find_data(args, args)
             if not weapon:
                 await self.bot.say(data)
                 return
@@ -679,7 +738,7 @@ class FireEmblemHeroes:
         if 'Evolution' in data:
             # weapon evolves
             args2 = data['Evolution'][0]
-            weapon2, categories2, data2 = self.find_data(args2, args2)
+            weapon2, categories2, data2 = await self.find_data(args2, args2)
             if not weapon2:
                 await self.bot.say(data2)
                 return
@@ -754,7 +813,7 @@ If you want to add a flaunt please send a screenshot of your unit to monkeybard,
             if username in self.cache.flaunts:
                 f = False
                 img_url = self.cache.flaunts[username]
-                del self.cache.flaunts[username]
+                self.cache.delete_flaunt(username)
                 self.cache.set_flaunt(user, img_url)
                 if username in self.flaunt_cache:
                     f = self.flaunt_cache[username]
@@ -762,9 +821,7 @@ If you want to add a flaunt please send a screenshot of your unit to monkeybard,
                     self.flaunt_cache[user] = f
         if f is not None and not f:
             print("Downloading flaunt for "+username)
-            request = urllib.request.Request(self.cache.flaunts[user].replace('cdn.discordapp.com', 'media.discordapp.net') + '?width=384&height=683', headers={'User-Agent': 'Mozilla/5.0'})
-            response = urllib.request.urlopen(request)
-            f = response.read()
+            status, headers, f = await fetch(self.cache.flaunts[user].replace('cdn.discordapp.com', 'media.discordapp.net') + '?width=384&height=683', timeout_dur=None)
             self.flaunt_cache[user] = f
         elif f is None:
             await self.bot.say("I'm afraid you have nothing to flaunt. If you want to add a flaunt please send a screenshot of your unit to monkeybard, Datagne, Zylphe, Circles or Mortagon.")
@@ -786,8 +843,6 @@ Possible Parameters (all optional):
 Example usage:
 ?stats lukas 5* +10 s +def -spd 0/14 0/-3/0/5
 will show the stats of a 5* Lukas merged to +10 with +Def -Spd IVs with a Summoner S Support and an additional 14 attack (presumably from a Slaying Lance+) as well as -3 attack and +5 defense (presumably from Fortress Defense)."""
-        self.cache.update()
-
         python_format = ctx.message.author.id in self.cache.python_preference
         if '-lukas' in args:
             python_format = False
@@ -798,7 +853,7 @@ will show the stats of a 5* Lukas merged to +10 with +Def -Spd IVs with a Summon
             args = list(args)
             args.remove('-python')
 
-        should_save, unit_stats = self.get_unit_stats(args, ctx=ctx)
+        should_save, unit_stats = await self.get_unit_stats(args, ctx=ctx)
         if isinstance(unit_stats, tuple):
             embed_info, base, max = unit_stats
             base = array_to_table(base)
@@ -846,8 +901,6 @@ Up to 15 units can be compared at the same time.
 By default differences will be shown when comparing 2 units but not for more.
 Use -d to show the difference as well as the stats. Use -q to only show the difference. Use -a to show who has the highest of each stat.
 Unlike ?fehstats, if a rarity is not specified I will use 5★ as the default."""
-        self.cache.update()
-
         args = list(map(lambda a:a.lower(), args))
         # try:
         #     separator, args = find_arg(args, separators, separators, 'separator', remove=False)
@@ -894,54 +947,48 @@ Unlike ?fehstats, if a rarity is not specified I will use 5★ as the default.""
             current_args.append(arg)
         if nth_unit > compare_limit:
             await self.bot.say('Cannot compare more than %d units at a time.' % compare_limit)
+            return
         if nth_unit > diff_limit and quiet_mode:
             await self.bot.say('Cannot show differences for more than %d units at a time.' % diff_limit)
             return
-        max_tables = []
-        curr_unit = 1
-        should_save = False
-        for request in unit_requests:
-            take_base = False
-            if 'lvl1' in request:
-                take_base = True
-                request.remove('lvl1')
-            save, ustats = self.get_unit_stats(request, default_rarity=5, ctx=ctx)
-            should_save = should_save or save
+        # lvl1 asks for base stats instead of max
+        take_base = ['lvl1' in request for request in unit_requests]
+        unit_requests = [[arg for arg in request if arg != 'lvl1'] if base else request
+                         for request, base in zip(unit_requests, take_base)]
+        results = await asyncio.gather(*[self.get_unit_stats(request, default_rarity=5, ctx=ctx) for request in unit_requests])
+        should_save = any(save for save, ustats in results)
+        for curr_unit, (save, ustats) in enumerate(results, 1):
             if not isinstance(ustats, tuple):
+                if should_save:
+                    self.cache.save()
                 await self.bot.say('I had difficulty finding what you wanted for unit %d. ' % curr_unit + ustats)
                 return
-            unit, base_t, max_t = ustats
-            if take_base:
-                stats_t = base_t
-            else:
-                stats_t = max_t
-            max_tables.append((shorten_hero_name(unit['Title']), stats_t))
-            curr_unit += 1
+        names = [shorten_hero_name(unit['Title']) for save, (unit, base_t, max_t) in results]
+        # the requested rarity is the only row left in each array
+        raw_stats = np.array([next(r for r in (base_t if base else max_t) if any(r))
+                              for (save, (unit, base_t, max_t)), base in zip(results, take_base)], dtype=np.int32).reshape(-1, 5)
+        totals = raw_stats.sum(axis=1)
         row_format = '|%-15.15s|%4s|%4s|%4s|%4s|%4s|%4s|\n'
         message = row_format % ('Unit', 'HP', 'ATK', 'SPD', 'DEF', 'RES', 'BST')
-        unit_number = 1
-        for unit in max_tables:
-            table = array_to_table(unit[1])[0]
-            message += row_format % (unit[0], table['HP'], table['ATK'], table['SPD'], table['DEF'], table['RES'], table['TOTAL'])
-            unit_number += 1
-        raw_stats = [np.array(list(filter(lambda r:any(r), t))[0]) for t in [table[1] for table in max_tables]]
+        message += ''.join(row_format % ((name,) + tuple(row) + (total,)) for name, row, total in zip(names, raw_stats, totals))
         messages = [message] if stats_mode else []
         if quiet_mode or nth_unit == 2:
-            for i in range(0, len(max_tables)-1):
-                nmessage = row_format % (max_tables[i][0][:13] + ' -', 'HP', 'ATK', 'SPD', 'DEF', 'RES', 'BST')
-                for j in range(i+1, len(max_tables)):
-                    difference = raw_stats[i] - raw_stats[j]
-                    nmessage += row_format % ('%15.15s' % max_tables[j][0], str(difference[0]), str(difference[1]), str(difference[2]), str(difference[3]), str(difference[4]), str(difference.sum()))
+            # differences[i][j] is unit i - unit j
+            differences = raw_stats[:, np.newaxis] - raw_stats[np.newaxis]
+            difference_totals = differences.sum(axis=2)
+            for i in range(0, len(names)-1):
+                nmessage = row_format % (names[i][:13] + ' -', 'HP', 'ATK', 'SPD', 'DEF', 'RES', 'BST')
+                nmessage += ''.join(row_format % (('%15.15s' % names[j],) + tuple(differences[i][j]) + (difference_totals[i][j],))
+                                    for j in range(i+1, len(names)))
                 messages.append(nmessage)
         if analytics_mode:
-            analytics_table = np.array(raw_stats).transpose()
             a_row_format = '|%7s|%5s %-31.31s|\n'
             amessage = a_row_format % ('Highest', 'Value', '(Character(s))')
-            for i in range(0, len(stats)):
-                characters = np.where(analytics_table[i]==analytics_table[i].max())[0]
-                amessage += a_row_format % (stats[i], str(analytics_table[i].max()), '('+', '.join([u[0] for u in [max_tables[j] for j in characters]])+')')
-            totals = analytics_table.sum(axis=0)
-            amessage += a_row_format % ('BST', str(totals.max()), '('+', '.join([u[0] for u in [max_tables[j] for j in np.where(totals==totals.max())[0]]])+')')
+            highest = np.column_stack([raw_stats, totals])
+            best = highest.max(axis=0)
+            leaders = highest == best
+            for i, stat in enumerate(stats + ['BST']):
+                amessage += a_row_format % (stat, str(best[i]), '('+', '.join([names[j] for j in np.flatnonzero(leaders[:, i])])+')')
             messages.append(amessage)
         curr_message = ''
         for message in messages:
@@ -955,10 +1002,115 @@ Unlike ?fehstats, if a rarity is not specified I will use 5★ as the default.""
         if should_save:
             self.cache.save()
 
-    @bot.command(aliases=['list', 'List', 'Fehlist', 'FEHlist', 'FEHList'])
-    async def fehlist(self, *args):
+    @bot.command(aliases=['learners', 'Learners', 'Fehlearners', 'FEHlearners', 'FEHLearners'])
+    async def fehlearners(self, *args):
+        """I will tell you which heroes learn a skill, or which skills a hero learns.
+Only heroes that have been looked up before are included.
+Add a rarity such as 3* to only see the heroes that learn the skill at that rarity.
+Example: ?learners fury 3 4*"""
+        args = list(args)
+        rarities = [str(i) + '*' for i in range(1, 6)]
+        try:
+            rarity, args = find_arg(args, rarities, range(1, 6), 'rarities')
+        except ValueError as err:
+            await self.bot.say(str(err))
+            return
+        name = ' '.join(args)
+        if not name:
+            await self.bot.say('Please tell me which skill or hero you want to know about.')
+            return
+        index = self.cache.skill_index
+        skill = index.find(name)
+        if skill is not None:
+            learners = index.learners(skill, rarity)
+            if not learners:
+                await self.bot.say('No hero I know of learns %s at %d★.' % (skill, rarity))
+                return
+            levels = {level: sorted(hero for hero in learners if learners[hero] == level) for level in range(1, 6)}
+            message = '**%s**\n' % skill + '\n'.join(['%d★: %s' % (level, ', '.join(map(shorten_hero_name, levels[level])))
+                                                     for level in levels if levels[level]])
+            unknown = sorted(hero for hero in learners if learners[hero] is None)
+            if unknown:
+                message += '\nRarity unknown: ' + ', '.join(map(shorten_hero_name, unknown))
+        else:
+            hero = self.cache.resolve_alias(name, save=False)
+            skills = index.skills(hero) if hero else {}
+            if not skills:
+                await self.bot.say("I don't know of a hero or skill called %s." % name.replace('*','\*').replace('_','\_'))
+                return
+            sections = {}
+            for skill, (learned, page, section) in skills.items():
+                if rarity is None or learned == rarity:
+                    sections.setdefault(section, []).append(skill + (' (%d★)' % learned if learned else ''))
+            if not sections:
+                await self.bot.say('%s learns nothing at %d★.' % (hero, rarity))
+                return
+            message = '**%s**\n' % hero + '\n'.join('**%s:** %s' % (section, ', '.join(sections[section])) for section in sections)
+        pager = ListPager(message.split('\n'), page_length=2000, separator='\n')
+        for page in range(1, len(pager) + 1):
+            await self.bot.say(pager.page(page)[2])
+
+    @bot.command(aliases=['search', 'Search', 'Fehsearch', 'FEHsearch', 'FEHSearch'])
+    async def fehsearch(self, *args):
+        """I will find the skills whose effects mention all of the words you give me.
+Only skills that have been looked up before are searched.
+Use -c followed by a category to only search that category, such as Weapons, Specials or Sacred Seals.
+Example: ?search distant counter -c weapons"""
+        args = list(args)
+        titles = None
+        if '-c' in args:
+            c_i = args.index('-c')
+            name = ' '.join(args[c_i+1:])
+            args = args[:c_i]
+            category = self.cache.category_index.find(name)
+            if category is None:
+                await self.bot.say("I don't know of any pages in the category %s." % name.replace('*','\*').replace('_','\_'))
+                return
+            titles = self.cache.category_index.titles(category)
+        if not args:
+            await self.bot.say('Please tell me what to search for.')
+            return
+        results = self.cache.text_index.search(' '.join(args), titles)
+        if not results:
+            await self.bot.say('No skills I know of mention %s.' % ' '.join(args).replace('*','\*').replace('_','\_'))
+            return
+        entries = ['**%s**: %s' % (skill, text if len(text) <= search_text_length else text[:search_text_length].rstrip() + '...')
+                   for score, title, skill, text in results[:search_limit]]
+        start, end, message = ListPager(entries, page_length=1900, separator='\n').page(1)
+        await self.bot.say('Results found: %d\nResults shown: %d\n%s' % (len(results), end, message))
+
+    @bot.command(aliases=['category', 'Category', 'Fehcategory', 'FEHcategory', 'FEHCategory'])
+    async def fehcategory(self, *, arg):
+        """I will list the pages I know of in a wiki category.
+Only pages that have been looked up before are included.
+Long categories are split into parts, add -p and a number to see a later one.
+Example: ?category Sacred Seals -p 2"""
+        words = arg.split()
+        page = 1
+        if len(words) > 2 and words[-2] == '-p' and words[-1].isdigit():
+            page, arg = int(words[-1]), ' '.join(words[:-2])
+        category = self.cache.category_index.find(arg.strip())
+        if category is None:
+            await self.bot.say("I don't know of any pages in the category %s." % arg.replace('*','\*').replace('_','\_'))
+            return
+        titles = sorted(self.cache.category_index.titles(category))
+        # room is left for the heading so each reply is a single message
+        pager = ListPager(titles, page_length=1800)
+        if not 1 <= page <= len(pager):
+            await self.bot.say('There %s only %d page%s of results.' % ('is' if len(pager) == 1 else 'are', len(pager), '' if len(pager) == 1 else 's'))
+            return
+        heading = '%s: %d page%s' % (category, len(titles), '' if len(titles) == 1 else 's')
+        if len(pager) > 1:
+            heading += '\nPart %d of %d' % (page, len(pager))
+            if page < len(pager):
+                heading += ', `?category %s -p %d` for the next part' % (category, page + 1)
+            heading += '.'
+        await self.bot.say('%s\n%s' % (heading, pager.page(page)[2]))
+
+    @bot.command(pass_context=True, aliases=['list', 'List', 'Fehlist', 'FEHlist', 'FEHList'])
+    async def fehlist(self, ctx, *args):
         """I will create a list of heroes to serve your needs.
-Usage: fehlist|list [-f filters] [-s fields_to_sort_by] [-r (reverse the results)]
+Usage: fehlist|list [-f filters] [-s fields_to_sort_by] [-r (reverse the results)] [-p page]
 Filters reduce the list down to the heroes you want. You can filter by Colour (Red, Blue, Green, Colourless), Weapon (Sword, Lance, Axe, Bow, Dagger, Staff, Tome, Breath) or Movement Type (Infantry, Cavalry, Flying, Armored). You can also filter by a stat threshold such as (HP>30) or (DEF+RES>50).
 Sorting fields let you choose how to sort the heroes. You can sort highest first in any stat (HP, ATK, SPD, DEF, RES, BST (Total)) or alphabetically by Name, Colour, Weapon or Movement Type. You can also sort by added stat totals such as (DEF+RES) or (ATK+SPD). The order you declare these will be the order of priority.
 There are shorthands to make it easier:
@@ -972,100 +1124,46 @@ You can filter by a stat or an added stat total by typing the stat(s) as you wou
 Example: !list -f red sword infantry -s attack hp
          is the same as
          !list -f r sw in -s atk hp
-         and will produce a list of units that are Red, wield Swords and are Infantry sorted by Attack and then by HP."""
-        self.cache.update()
-
+         and will produce a list of units that are Red, wield Swords and are Infantry sorted by Attack and then by HP.
+Lists too long for one message are split into pages, -p 2 on its own shows the second page of your last list."""
         try:
-            if args:
-                if (len(args) > 1 and '-r' in args and '-f' not in args and '-s' not in args) or\
-                    ('-r' not in args and '-f' not in args and '-s' not in args) or\
-                    (args[0] not in ['-r', '-f', '-s']) or\
-                    ('-r' in args and args[-1] != '-r' and args[args.index('-r')+1] not in ['-f', '-s']) or\
-                    any('-' in arg and arg not in ['-r', '-f', '-s'] for arg in args):
-                    await self.bot.say('Unfortunately I had trouble figuring out what you wanted. Are you sure you typed the command correctly?\n```Usage: fehlist|list [-f filters] [-s fields_to_sort_by] [-r]```')
-                    return
-
-            # set up argument parser
-            parser = argparse.ArgumentParser(description='Process arguments for heroes list.')
-            parser.add_argument('-f', nargs='*')
-            parser.add_argument('-s', nargs='*')
-            parser.add_argument('-r', action='store_const', const=False, default=True)
-            args = vars(parser.parse_args(args=args))
-            filters = {}
-            if args['f']:
-                filters = standardize(args, 'f')
-                if filters is None:
-                    await self.bot.say('Invalid filters or multiple filters for the same field were selected.')
-                    return
-            sort_keys = []
-            if args['s']:
-                sort_keys = standardize(args, 's')
-                if sort_keys is None:
-                    await self.bot.say('Invalid fields to sort by were selected.')
-                    return
             try:
-                heroes = get_heroes_list()
-                self.cache.set_list(heroes)
-            except urllib.error.HTTPError as err:
-                if err.code >= 500:
-                    if self.cache.list:
-                        heroes = self.cache.list
-                    else:
-                        await self.bot.say("Unfortunately, it seems like I cannot access my sources at the moment. Please try again later.")
-                        return
-            except timeout:
-                print('Timed out')
-            except AttributeError:
-                print('Source had an error')
-            finally:
-                if self.cache.list:
-                    heroes = self.cache.list
-            # convert from dict to list for easy manipulation
-            heroes = [heroes[h] for h in heroes]
-            for f in filters:
-                if f != 'Threshold':
-                    heroes = list(filter(lambda h:h[f] in filters[f], heroes))
-                else:
-                    for t in filters[f]:
-                        heroes = list(filter(lambda h:t[0](list(itertools.accumulate([h[field] for field in t[1]]))[-1], t[2]), heroes))
-            if not heroes:
+                query, page = compile_list_query(args)
+            except ListQueryError as err:
+                await self.bot.say(str(err))
+                return
+            user = ctx.message.author.id
+            cursor = self.list_cursors.get(user)
+            if cursor is not None and page is not None and args == ('-p', str(page)):
+                # only a page was asked for, it's from the user's last list
+                query = cursor[0]
+            if not self.cache.list:
+                # nothing cached yet, wait for the list instead of the next background refresh
+                await self.refresh_heroes_list()
+                if not self.cache.list:
+                    await self.bot.say("Unfortunately, it seems like I cannot access my sources at the moment. Please try again later.")
+                    return
+            table = self.cache.get_hero_table()
+            if cursor is None or cursor[0] != query or cursor[1] != table.version:
+                indices = table.query(query)
+                cursor = (query, table.version, indices, ListPager(table.entries(indices, query.sort_keys)))
+            self.list_cursors.put(user, cursor)
+            query, version, indices, pager = cursor
+            if not len(indices):
                 await self.bot.say('No results found for selected filters.')
                 return
-            num_results = len(heroes)
-            sort_keys.append('Name')
-            for key in reversed(sort_keys):
-                heroes = sorted(heroes,
-                                key=lambda h:
-                                    list(
-                                        itertools.accumulate([h[field] for field in key] if isinstance(key, tuple) else [h[key]]))[-1],
-                                        reverse=not args['r'] if key in ['Name', 'Movement', 'Colour', 'Weapon'] else args['r']
-                                        )
-            sort_keys.pop()
-            list_string = ', '.join([
-                shorten_hero_name(h['Name']) + (
-                    (' ('+','.join([
-                        str(
-                            list(itertools.accumulate([h[field] for field in k] if isinstance(k, tuple) else [h[k]]))[-1]
-                            ) for k in sort_keys if k != 'Name'
-                        ])+')' if sort_keys else '')
-                    if len(sort_keys) != 1 or sort_keys[0] != 'Name' else ''
-                    ) for h in heroes
-                ])
-            while len(list_string) > 2000:
-                list_string = ', '.join([
-                    shorten_hero_name(h['Name']) + (
-                        (' ('+','.join([
-                            str(
-                                list(itertools.accumulate([h[field] for field in k] if isinstance(k, tuple) else [h[k]]))[-1]
-                                ) for k in sort_keys if k != 'Name'
-                            ])+')' if sort_keys else '')
-                        if len(sort_keys) != 1 or sort_keys[0] != 'Name' else ''
-                        ) for h in heroes
-                    ])
-                heroes = heroes[:-1]
+            page = page or 1
+            if page > len(pager):
+                await self.bot.say('There %s only %d page%s of results.' % ('is' if len(pager) == 1 else 'are', len(pager), '' if len(pager) == 1 else 's'))
+                return
+            num_results = len(indices)
+            start, end, list_string = pager.page(page)
+            heroes = [table.rows[i] for i in indices[start:end]]
             results_string = 'Results found: %d\nResults shown: %d\nIf you wish to compare these units in greater detail:' % (num_results, len(heroes))
             if num_results > 1 and num_results <= compare_limit:
                 results_string += '\n`?compare %s -a`' % ' & '.join(shorten_hero_name(h['Name']) if shorten_hero_name(h['Name']).lower() not in self.cache.categories else h['Name'] for h in heroes)
+            if len(pager) > 1:
+                results_string += '\nPage %d of %d' % (page, len(pager)) + ('' if page == len(pager) else ', `?list -p %d` for the next one.' % (page + 1))
             await self.bot.say(results_string)
             await self.bot.say(list_string)
         except timeout: